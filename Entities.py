@@ -5,24 +5,93 @@ Created on Mon Oct  7 10:09:40 2019
 @author: slab
 """
 import math
+from contextlib import contextmanager
 
 from dxfwrite.mixins import SubscriptAttributes
 from dxfwrite import const
-from dxfwrite.algebra import rotate_2d
 from dxfwrite.base import DXFList,dxfstr
 from dxfwrite.entities import Polyline, Solid
-from dxfwrite.vector2d import vadd, vsub
+from dxfwrite.vector2d import vadd
+
+import numpy as np
+
+from maskLib.utilities import cornerRound, pointArray, toPoints, transformPoints, getChordTolerance, chordSegments, unitArc
+
+# ===============================================================================
+#  SOLID FILL MODES
+#       how background solids are built for shapes filled as a fan of triangles
+#       'triangles':  one SOLID per triangle (default)
+#       'quads':      neighbouring triangles are merged into one quadrangle SOLID wherever it is convex
+#       the mode is chosen per wafer (Wafer fillMode), and applied while the wafer is written
+# ===============================================================================
+fillModes = ('triangles','quads')
+_fillMode = ['triangles']
+
+def getFillMode():
+    return _fillMode[-1]
+
+@contextmanager
+def fillMode(mode):
+    ''' use a fill mode for all tags built inside the with block '''
+    if mode not in fillModes:
+        raise ValueError('Unknown fill mode '+str(mode)+', use one of '+str(fillModes))
+    _fillMode.append(mode)
+    try:
+        yield mode
+    finally:
+        _fillMode.pop()
+
+def _isConvex(pts):
+    #true if the polygon (in order) has no reflex corners
+    cross = [(pts[i-1][0]-pts[i-2][0])*(pts[i][1]-pts[i-1][1]) - (pts[i-1][1]-pts[i-2][1])*(pts[i][0]-pts[i-1][0]) for i in range(len(pts))]
+    return min(cross) >= 0 or max(cross) <= 0
+
+def solidFan(points,color,layer):
+    ''' background solids filling points as a fan from the first point, built according to the fill mode '''
+    solids = []
+    n = len(points)
+    i = 0
+    quads = getFillMode() == 'quads'
+    while i < n-2:
+        if quads and i < n-3 and _isConvex([points[j] for j in [0,i+1,i+2,i+3]]):
+            solids.append(Solid([points[j] for j in [0,i+1,i+2,i+3]], color=color, layer=layer))
+            i += 2
+        else:
+            solids.append(Solid([points[j] for j in [0,i+1,i+2]], color=color, layer=layer))
+            i += 1
+    return solids
 
-from maskLib.utilities import cornerRound
+class TagCache:
+    ''' Memoizes __dxftags__: the tags are built once by _build() and reused until the shape changes.
+        Setting any attribute (directly or with entity['key']=value) invalidates the cache, as does a change of fill mode
+    '''
+    _tags = None
+    
+    def __setattr__(self,name,value):
+        object.__setattr__(self,name,value)
+        object.__setattr__(self,'_tags',None)
+        
+    def invalidate(self):
+        ''' force a rebuild (eg. after modifying the points list in place) '''
+        object.__setattr__(self,'_tags',None)
+        
+    def __dxftags__(self):
+        mode = getFillMode()
+        if self._tags is None or self._tags[0] != mode:
+            tags = self._build()
+            object.__setattr__(self,'_tags',(mode,tags))
+        return self._tags[1]
 
-class SolidPline(SubscriptAttributes):
+class SolidPline(TagCache,SubscriptAttributes):
     ''' Shape consisting of a Polyline and solid background** if polyline has 4 points or less
             acts like a Polyline, quacks like a Polyline, but generates a polyline + solid when dxf tags are called
         If polyline has >4 points, builds up solid out of triangles starting at first point
+        fill: background solids to use instead (list of 3 or 4 points each, in polygon order like dxf.solid), for shapes whose
+            fan would not cover them (eg. polygonBoolean pieces)
     '''
     name = 'SOLIDPLINE'
     
-    def __init__(self,insert,rotation=0.,color=const.BYLAYER,bgcolor=None,layer='0',linetype=None, points=None, solidFillQuads=False, **kwargs):
+    def __init__(self,insert,rotation=0.,color=const.BYLAYER,bgcolor=None,layer='0',linetype=None, points=None, solidFillQuads=False, fill=None, **kwargs):
         self.insert = insert
         self.rotation = math.radians(rotation)
         self.color = color
@@ -37,6 +106,7 @@ class SolidPline(SubscriptAttributes):
         self.transformed_points = self.points
         
         self.solidFillQuads = solidFillQuads
+        self.fill = fill
 
     
     def _build(self):
@@ -45,22 +115,25 @@ class SolidPline(SubscriptAttributes):
         if self.color is not None:
             data.append(self._build_polyline())
         if self.bgcolor is not None:
-            if len(self.points) <= 4:
+            if self.fill is not None:
+                data.extend(Solid(self._transform_points(pts), color=self.bgcolor, layer=self.layer) for pts in self.fill)
+            elif len(self.points) <= 4:
                 data.append(self._build_solid())
             elif self.solidFillQuads:
                 for i in range(len(self.points)//2 -1):
                     data.append(self._build_solid_quad(i))
             else:
-                for i in range(len(self.points)-2):
-                    data.append(self._build_solid_triangle(i))
+                data.extend(solidFan(self.transformed_points,self.bgcolor,self.layer))
             
         return data
         
     def _transform_points(self,points):
-        return [vadd(self.insert,  # move to insert point
-                            rotate_2d(  # rotate at origin
-                                point, self.rotation))
-                       for point in points]
+        # rotate at origin, then move to insert point (all points at once)
+        return toPoints(transformPoints(points,self.insert,self.rotation))
+    
+    def outline(self):
+        ''' placed outline points, without building any tags (eg. for GDSII output) '''
+        return self._transform_points(self.points)
         
     def _build_polyline(self):
         '''Build the polyline (key component)'''
@@ -79,6 +152,7 @@ class SolidPline(SubscriptAttributes):
     def add_vertex(self,point,**kwargs):
         '''add a vertex located at point, dump kwargs'''
         self.points.append(point)
+        self.invalidate()
 
     def _build_solid(self):
         """ build a single unified background solid (only works for 4 points)"""
@@ -97,9 +171,6 @@ class SolidPline(SubscriptAttributes):
     def __dxf__(self):
         ''' get the dxf string '''
         return dxfstr(self.__dxftags__())
-    
-    def __dxftags__(self):
-        return self._build()
 
 
 
@@ -182,7 +253,7 @@ class CurveRect(SolidPline):
     '''
     name = 'CURVERECT'
     
-    def __init__(self,insert,height,radius,roffset=0,angle=90,ptDensity=60,rotation=0.,color=const.BYLAYER,bgcolor=None,layer='0',linetype=None,ralign=const.BOTTOM,valign=const.BOTTOM,vflip=False,hflip=False, **kwargs):
+    def __init__(self,insert,height,radius,roffset=0,angle=90,ptDensity=60,rotation=0.,color=const.BYLAYER,bgcolor=None,layer='0',linetype=None,ralign=const.BOTTOM,valign=const.BOTTOM,vflip=False,hflip=False,tolerance=None, **kwargs):
         self.insert = insert
         self.rotation = math.radians(rotation)
         self.color = color
@@ -197,7 +268,13 @@ class CurveRect(SolidPline):
         
         self.roffset=roffset
         self.angle = math.radians(angle)
-        self.segments = max(int(ptDensity*angle/360),1)
+        tolerance = getChordTolerance(tolerance)
+        if tolerance is None:
+            self.segments = max(int(ptDensity*angle/360),1)
+        else:
+            #the outer edge has the largest radius
+            rmin = radius+self._get_radius_align()[1]+roffset
+            self.segments = chordSegments(max(abs(rmin),abs(rmin+height)),self.angle,tolerance)
         
         self.vflip = vflip and -1 or 1
         self.hflip = hflip and -1 or 1
@@ -228,75 +305,55 @@ class CurveRect(SolidPline):
 
         return (0, dy)
     
+    def outline(self):
+        return self._transform_points(self._calc_points(self._get_radius_align()),self._get_align_vector())
+    
     def _build(self):
         data = DXFList()
         ralign = self._get_radius_align()
         self.points = self._calc_points(ralign)
         align_vector = self._get_align_vector()
-        self._transform_points(align_vector)
+        self.transformed_points = self._transform_points(self.points,align_vector)
         if self.color is not None:
             data.append(self._build_polyline())
         if self.bgcolor is not None:
-            #if _calc_points has been run, rmin is already set
-            if self.rmin <= 0:
+            if self._radii(ralign)[0] <= 0:
                 #if self.angle%(2*math.pi) == math.radians(90): #rounded corner case
-                for i in range(self.segments+1):
-                    data.append(self._build_solid_triangle(i))
+                data.extend(solidFan(self.transformed_points,self.bgcolor,self.layer))
             else: #rmin>0, normal operation
                 for i in range(self.segments+1):
                     data.append(self._build_solid_quad(i))
         return data
         
-    def _transform_points(self,align):
-        self.points = [vadd(self.insert,  # move to insert point
-                            rotate_2d(  # rotate at origin
-                                ((point[0]+align[0])*self.hflip,(point[1]+align[1])*self.vflip), self.rotation))
-                       for point in self.points]
+    def _transform_points(self,points,align):
+        # align, flip, rotate at origin, then move to insert point
+        return toPoints(transformPoints(points,self.insert,self.rotation,scale=(self.hflip,self.vflip),offset=align))
+    
+    def _radii(self,align):
+        #inner and outer radius for the radius alignment (not stored: setting attributes clears the tag cache)
+        rmin = self.r0+align[1]+self.roffset
+        rmax = self.r0+self.height+align[1]+self.roffset
+        if rmin <= 0 and self.angle%(2*math.pi) != math.radians(90):  #not designed for doing more than one nicely rounded corner at a time
+            rmin = 0
+        return rmin,rmax
     
     def _calc_points(self,align):
         #align=self._get_align_vector()
-        self.rmin=self.r0+align[1]+self.roffset
-        self.rmax=self.r0+self.height+align[1]+self.roffset
+        rmin,rmax = self._radii(align)
         
         dTheta = self.angle/self.segments
-        pts = []
-        if self.rmin <=0:
-            if self.angle%(2*math.pi) != math.radians(90):  #not designed for doing more than one nicely rounded corner at a time
-                self.rmin = 0
-            pts = [(0,self.rmin-self.r0),(self.rmax*math.sin(self.angle)-self.rmin,self.rmax*math.cos(self.angle)-self.r0+self.rmin)]
-            pts = pts + [(self.rmax*math.sin(self.angle-(i+0.5)*dTheta)-self.rmin,self.rmax*math.cos(self.angle-(i+0.5)*dTheta)-self.r0) for i in range(self.segments)] + [(0,self.rmax - self.r0)]
+        if rmin <=0:
+            thetas = self.angle-(np.arange(self.segments)+0.5)*dTheta
+            pts = np.concatenate(([(0,rmin-self.r0),(rmax*math.sin(self.angle)-rmin,rmax*math.cos(self.angle)-self.r0+rmin)],
+                                  np.column_stack((rmax*np.sin(thetas)-rmin,rmax*np.cos(thetas)-self.r0)),
+                                  [(0,rmax - self.r0)]))
         else:
-            pts = [(0,self.rmin-self.r0)]+[(self.rmin*math.sin((i+1)*dTheta),self.rmin*math.cos((i+1)*dTheta)-self.r0) for i in range(self.segments-1)]+[(self.rmin*math.sin(self.angle),self.rmin*math.cos(self.angle)-self.r0)]
-            pts = pts + [(self.rmax*math.sin(self.angle),self.rmax*math.cos(self.angle)-self.r0)] + [(self.rmax*math.sin(self.angle-(i+1)*dTheta),self.rmax*math.cos(self.angle-(i+1)*dTheta)-self.r0) for i in range(self.segments-1)] + [(0,self.rmax - self.r0)]
-        
+            #inner edge runs from 0 to angle, outer edge returns from angle to 0
+            arc = unitArc(self.angle,self.segments)[:,::-1]
+            pts = np.concatenate((rmin*arc,rmax*arc[::-1])) - (0,self.r0)
         
-        return [vsub(pt,align) for pt in pts]
-    
-    def _build_polyline(self):
-        '''Build the polyline (key component)'''
-        polyline = Polyline(self.points, color=self.color, layer=self.layer,flags=0)
-        polyline.close() #redundant in most cases
-        if self.linetype is not None:
-            polyline['linetype'] = self.linetype
-        return polyline
-    
-    def _build_solid_quad(self,i,center=None):
-        ''' build a single background solid quadrangle segment '''
-        solidpts = [self.points[j] for j in [i,i+1,-i-2,-i-1]]
-        return Solid(solidpts, color=self.bgcolor, layer=self.layer)  
+        return pts - align
 
-    
-    def _build_solid_triangle(self,i):
-        ''' build a single background solid quadrangle segment '''
-        solidpts = [self.points[j] for j in [0,i+1,i+2]]
-        return Solid(solidpts, color=self.bgcolor, layer=self.layer)  
-    
-    def __dxf__(self):
-        ''' get the dxf string '''
-        return dxfstr(self.__dxftags__())
-    
-    def __dxftags__(self):
-        return self._build() 
 
 class MiterJoint(SolidPline):
     ''' Curved joint shape consisting of a single Polyline and a number of background solids
@@ -304,7 +361,7 @@ class MiterJoint(SolidPline):
     '''
     name = 'MITERJOINT'
     
-    def __init__(self,insert,height,w1,roffset=0,ptDensity=60,rotation=0.,color=const.BYLAYER,bgcolor=None,layer='0',linetype=None,valign=const.BOTTOM,vflip=False,hflip=False, **kwargs):
+    def __init__(self,insert,height,w1,roffset=0,ptDensity=60,rotation=0.,color=const.BYLAYER,bgcolor=None,layer='0',linetype=None,valign=const.BOTTOM,vflip=False,hflip=False,tolerance=None, **kwargs):
         self.insert = insert
         self.rotation = math.radians(rotation)
         self.color = color
@@ -321,12 +378,16 @@ class MiterJoint(SolidPline):
         
         angle = 45
         self.angle = math.radians(angle)
-        self.segments = max(int(ptDensity*angle/360),1)
         
         self.vflip = vflip and -1 or 1
         self.hflip = hflip and -1 or 1
         
         self.r0 = max((w1-math.sqrt(2)*height)/(math.sqrt(2)-2),0)
+        tolerance = getChordTolerance(tolerance)
+        if tolerance is None:
+            self.segments = max(int(ptDensity*angle/360),1)
+        else:
+            self.segments = chordSegments(self.r0,self.angle,tolerance)
 
     def _get_align_vector(self):
 
@@ -340,46 +401,33 @@ class MiterJoint(SolidPline):
 
         return (0, dy)
     
+    def outline(self):
+        return self._transform_points(self._calc_points(),self._get_align_vector())
+    
     def _build(self):
         data = DXFList()
         self.points = self._calc_points()
         align_vector = self._get_align_vector()
-        self._transform_points(align_vector)
+        self.transformed_points = self._transform_points(self.points,align_vector)
         if self.color is not None:
             data.append(self._build_polyline())
         return data
         
-    def _transform_points(self,align):
-        self.points = [vadd(self.insert,  # move to insert point
-                            rotate_2d(  # rotate at origin
-                                ((point[0]+align[0])*self.hflip,(point[1]+align[1])*self.vflip), self.rotation))
-                       for point in self.points]
+    def _transform_points(self,points,align):
+        # align, flip, rotate at origin, then move to insert point
+        return toPoints(transformPoints(points,self.insert,self.rotation,scale=(self.hflip,self.vflip),offset=align))
     
     def _calc_points(self):
         #align=self._get_align_vector()
         
-        dTheta = self.angle/self.segments
-        pts = [(0,self.height),(0,0)]+[(self.r0*math.sin((i+1)*dTheta),self.r0*math.cos((i+1)*dTheta)-self.r0) for i in range(self.segments-1)]+[(self.r0*math.sin(self.angle),self.r0*math.cos(self.angle)-self.r0)]
-        pts = pts + [(self.height+self.r0-self.r0*math.cos(self.angle),self.height-self.r0*math.sin(self.angle))] + [(self.height+self.r0-self.r0*math.cos(self.angle-(i+1)*dTheta),self.height-self.r0*math.sin(self.angle-(i+1)*dTheta)) for i in range(self.segments-1)] + [(self.height,self.height)]
-        
+        #first curve runs from 0 to angle, second curve returns from angle to 0
+        cos, sin = self.r0*unitArc(self.angle,self.segments).T
+        pts = np.concatenate(([(0,self.height)],
+                              np.column_stack((sin,cos-self.r0)),
+                              np.column_stack((self.height+self.r0-cos[::-1],self.height-sin[::-1]))))
         
         return pts
     
-    def _build_polyline(self):
-        '''Build the polyline (key component)'''
-        polyline = Polyline(self.points, color=self.color, layer=self.layer,flags=0)
-        polyline.close() #redundant in most cases
-        if self.linetype is not None:
-            polyline['linetype'] = self.linetype
-        return polyline  
-    
-    def __dxf__(self):
-        ''' get the dxf string '''
-        return dxfstr(self.__dxftags__())
-    
-    def __dxftags__(self):
-        return self._build() 
-    
 class RoundRect(SolidPline):
     ''' Rectangle with rounded edges. Consists of a closed polyline and multiple solids faces.
         NOTE: does not cover negative width / height like rectangle()
@@ -388,7 +436,7 @@ class RoundRect(SolidPline):
 
     def __init__(self, insert, width, height, radius, roundCorners=[1,1,1,1],
                  halign=const.LEFT, valign=const.BOTTOM,
-                 hflip=False, vflip = False,ptDensity=120,**kwargs):
+                 hflip=False, vflip = False,ptDensity=120,tolerance=None,**kwargs):
         self.width = abs(float(width))
         self.height = abs(float(height))
         self.radius = abs(float(radius))
@@ -402,6 +450,7 @@ class RoundRect(SolidPline):
         self.roundCorners=roundCorners
         
         self.ptDensity = ptDensity
+        self.tolerance = tolerance
         
         #make all corners square if radius is zero
         if self.radius <=0:
@@ -415,17 +464,17 @@ class RoundRect(SolidPline):
                   (0., self.height)]
         align_vector=self._get_align_vector()
         
-        points = [self._get_flipped_point(vadd((0.,self.height/2),align_vector))]
+        points = [(0.,self.height/2)]
         quadrants = [3,4,1,2]
         
         for i,sqpt in enumerate(square_points):
             if self.roundCorners[i]:
-                for p in cornerRound(sqpt, quadrants[i], self.radius,clockwise=False,ptDensity=self.ptDensity):
-                    points.append(self._get_flipped_point(vadd(align_vector,p)))
+                points.extend(cornerRound(sqpt, quadrants[i], self.radius,clockwise=False,ptDensity=self.ptDensity,tolerance=self.tolerance))
             else:
-                points.append(self._get_flipped_point(vadd(align_vector,sqpt)))
+                points.append(sqpt)
         
-        return points
+        #align and flip all points at once
+        return toPoints(transformPoints(points,scale=self._get_flip_vector(),offset=align_vector))
 
     def _get_align_vector(self):
         if self.halign == const.CENTER:
@@ -445,10 +494,15 @@ class RoundRect(SolidPline):
 
         return (dx, dy)
     
-    def _get_flipped_point(self,point):
+    def _get_flip_vector(self):
         cx = self.hflip and -1 or 1
         cy = self.vflip and -1 or 1
         
+        return (cx,cy)
+    
+    def _get_flipped_point(self,point):
+        cx,cy = self._get_flip_vector()
+        
         return ((point[0]*cx,point[1]*cy))
     
 class RoundRectInverse(RoundRect):
@@ -460,14 +514,14 @@ class RoundRectInverse(RoundRect):
 
     def __init__(self, insert, width, height, radius, roundCorners=[1,1,1,1],invertCorners=[0,1,1,0],invertHorizontal=True,
                  halign=const.LEFT, valign=const.BOTTOM,
-                 hflip=False, vflip = False,ptDensity=120,**kwargs):
+                 hflip=False, vflip = False,ptDensity=120,tolerance=None,**kwargs):
 
         self.invertCorners=invertCorners
         self.invertHorizontal=invertHorizontal
         
         RoundRect.__init__(self,insert, width, height, radius, roundCorners=roundCorners,
                      halign=halign, valign=valign,
-                     hflip=hflip, vflip = vflip,ptDensity=ptDensity,**kwargs)
+                     hflip=hflip, vflip = vflip,ptDensity=ptDensity,tolerance=tolerance,**kwargs)
         
 
     def _calc_corners(self):
@@ -475,7 +529,7 @@ class RoundRectInverse(RoundRect):
                   (0., self.height)]
         align_vector=self._get_align_vector()
         
-        points = [self._get_flipped_point(vadd((0.,self.height/2),align_vector))]
+        points = [(0.,self.height/2)]
         quadrants = [3,4,1,2]
         if self.invertHorizontal:
             iquadrants = [4,3,2,1]
@@ -489,20 +543,20 @@ class RoundRectInverse(RoundRect):
                     quad = iquadrants[i]
                 else:
                     quad = quadrants[i]
-                for p in cornerRound(sqpt, quad, self.radius,clockwise=self.invertCorners[i],ptDensity=self.ptDensity):
-                    points.append(self._get_flipped_point(vadd(align_vector,p)))
+                points.extend(cornerRound(sqpt, quad, self.radius,clockwise=self.invertCorners[i],ptDensity=self.ptDensity,tolerance=self.tolerance))
             else:
-                points.append(self._get_flipped_point(vadd(align_vector,sqpt)))
+                points.append(sqpt)
         
-        return points
+        #align and flip all points at once
+        return toPoints(transformPoints(points,scale=self._get_flip_vector(),offset=align_vector))
 
 
-class InsideCurve(SubscriptAttributes):
+class InsideCurve(TagCache,SubscriptAttributes):
     ''' Filled inside corner rounded to radius r consisting of a single Polyline and a number of background solids
     '''
     name = 'INSIDECURVE'
     
-    def __init__(self,insert,radius,angle=90,ptDensity=60,rotation=0.,color=const.BYLAYER,bgcolor=None,layer='0',linetype=None,halign=const.RIGHT,vflip=False,hflip=False, **kwargs):
+    def __init__(self,insert,radius,angle=90,ptDensity=60,rotation=0.,color=const.BYLAYER,bgcolor=None,layer='0',linetype=None,halign=const.RIGHT,vflip=False,hflip=False,tolerance=None, **kwargs):
         self.insert = insert
         self.rotation = math.radians(rotation)
         self.color = color
@@ -515,7 +569,11 @@ class InsideCurve(SubscriptAttributes):
         self.r0 = radius
         self.angle = math.radians(angle)
         self.curve_angle = math.radians(180-angle)
-        self.segments = int(ptDensity*abs(180-angle)/360)
+        tolerance = getChordTolerance(tolerance)
+        if tolerance is None:
+            self.segments = int(ptDensity*abs(180-angle)/360)
+        else:
+            self.segments = chordSegments(radius,self.curve_angle,tolerance)
         
         self.vflip = vflip and -1 or 1
         self.hflip = hflip and -1 or 1
@@ -532,38 +590,37 @@ class InsideCurve(SubscriptAttributes):
 
         return (0, dx)
     
+    def outline(self):
+        ''' placed outline points, without building any tags (eg. for GDSII output) '''
+        return self._transform_points(self._calc_points())
+    
     def _build(self):
         data = DXFList()
         self.points = self._calc_points()
-        self._transform_points()
+        self.transformed_points = self._transform_points(self.points)
         if self.color is not None:
             data.append(self._build_polyline())
         if self.bgcolor is not None:
-            #if _calc_points has been run, rmin is already set
-            for i in range(self.segments):
-                data.append(self._build_solid_triangle(i))
+            data.extend(solidFan(self.transformed_points,self.bgcolor,self.layer))
         return data
         
-    def _transform_points(self):
+    def _transform_points(self,points):
+        # flip, align, rotate at origin, then move to insert point
         align = self._get_align_vector()
-        self.points = [vadd(self.insert,  # move to insert point
-                            rotate_2d(  # rotate at origin
-                                vadd((point[0]*self.hflip,point[1]*self.vflip),align), self.rotation))
-                       for point in self.points]
+        pts = pointArray(points)*(self.hflip,self.vflip) + align
+        return toPoints(transformPoints(pts,self.insert,self.rotation))
     
     def _calc_points(self):
         #align=self._get_align_vector()
         center = (-self.r0/math.tan(self.angle/2),-self.r0)
         
-        dTheta = self.curve_angle/self.segments
-        pts = []
-        pts = [(0,0)]+[vadd((self.r0*math.sin(i*dTheta),self.r0*math.cos(i*dTheta)),center) for i in range(self.segments+1)]
+        pts = np.concatenate(([(0,0)],self.r0*unitArc(self.curve_angle,self.segments)[:,::-1] + center))
         
         return pts
     
     def _build_polyline(self):
         '''Build the polyline (key component)'''
-        polyline = Polyline(self.points, color=self.color, layer=self.layer,flags=0)
+        polyline = Polyline(self.transformed_points, color=self.color, layer=self.layer,flags=0)
         polyline.close() #redundant in most cases
         if self.linetype is not None:
             polyline['linetype'] = self.linetype
@@ -571,15 +628,12 @@ class InsideCurve(SubscriptAttributes):
 
     def _build_solid_triangle(self,i):
         ''' build a single background solid quadrangle segment '''
-        solidpts = [self.points[j] for j in [0,i+1,i+2]]
+        solidpts = [self.transformed_points[j] for j in [0,i+1,i+2]]
         return Solid(solidpts, color=self.bgcolor, layer=self.layer)  
     
     def __dxf__(self):
         ''' get the dxf string '''
-        return dxfstr(self.__dxftags__())
-    
-    def __dxftags__(self):
-        return self._build() 
+        return dxfstr(self.__dxftags__()) 
         
         
         
@@ -5,6 +5,20 @@ Created on Fri Jan  5 12:35:23 2018
 @author: sasha
 """
 import math
+import os
+import copy
+import glob
+import pickle
+import codecs
+import hashlib
+import inspect
+import tempfile
+import functools
+import multiprocessing
+from struct import pack
+from functools import lru_cache
+
+import numpy as np
 
 from dxfwrite import const
 #force all 2D polylines by disabling 3D polyline flags
@@ -14,6 +28,12 @@ from dxfwrite import DXFEngine as dxf
 
 from dxfwrite.vector2d import vadd,midpoint,vmul_scalar,vsub
 from dxfwrite.algebra import rotate_2d
+from dxfwrite.rect import Rectangle
+from dxfwrite.base import tags2str, iterdxftags, DXFList, DXFAtom, DXFName, DXFPoint, dxfstr
+from dxfwrite.entities import _Entity, Insert, Polyline, Solid, Circle, Line
+
+from maskLib.utilities import transformPoints, cellRuns, pointArray, toPoints, polygonBoolean
+from maskLib.Entities import fillMode, SolidPline, TagCache
 
 
 
@@ -91,13 +111,92 @@ def skewRect(corner,width,height,offset,newLength,edge=1,**kwargs):
     taper.close()
     return taper
 
+# ===============================================================================
+#  CHIP PLACEMENT
+#       vectorized layout of the chip grid on a circular wafer
+# ===============================================================================
+
+def chipGrid(pitchX,pitchY,radius,offset=(0,0),exclusions=(),singleColumn=False,singleRow=False):
+    '''
+    Lower left corners of all chip cells (pitchX by pitchY) that fit entirely inside a circle of the given radius.
+    Returns an (N,2) array of corners sorted left to right, then bottom to top, and the number of chips in
+    each column at or left of the wafer center (left to right)
+    # offset:       shift of the whole grid from the wafer center
+    # exclusions:   keep-out rectangles [(x0,y0),(x1,y1)] in wafer coordinates (eg. alignment marks, wafer flat)
+    # singleColumn: only one column, centered on the Y axis
+    # singleRow:    only one row, centered on the X axis
+    '''
+    if singleColumn:
+        i = np.array([-0.5])
+    else:
+        i = np.arange(math.floor((-radius-offset[0])/pitchX)-1,math.ceil((radius-offset[0])/pitchX)+1)
+    if singleRow:
+        j = np.array([-0.5])
+    else:
+        j = np.arange(math.floor((-radius-offset[1])/pitchY)-1,math.ceil((radius-offset[1])/pitchY)+1)
+    x,y = np.meshgrid(i*pitchX+offset[0],j*pitchY+offset[1],indexing='ij')
+    x,y = x.ravel(),y.ravel()
+    if singleColumn and singleRow:
+        #only one chip on the wafer
+        valid = np.ones(1,dtype=bool)
+    else:
+        #farthest corner of each cell from the wafer center
+        farX = np.maximum(np.abs(x),np.abs(x+pitchX))
+        #single rows have always kept a full chip height of clearance
+        if singleRow:
+            farY = np.full_like(y,pitchY)
+        else:
+            farY = np.maximum(np.abs(y),np.abs(y+pitchY))
+        valid = farX**2 + farY**2 < radius**2
+    for (x0,y0),(x1,y1) in exclusions:
+        valid &= ~((x < max(x0,x1)) & (x+pitchX > min(x0,x1)) & (y < max(y0,y1)) & (y+pitchY > min(y0,y1)))
+    pts = np.stack((x[valid],y[valid]),axis=-1)
+    pts = pts[np.lexsort((pts[:,1],pts[:,0]))]
+    if singleColumn:
+        return pts,[len(pts)]
+    colX,colCounts = np.unique(pts[:,0],return_counts=True)
+    return pts,colCounts[colX+0.5*pitchX <= 0].tolist()
+
+def _gridCounts(pitchX,pitchY,radius,offsets):
+    #number of whole cells inside the circle for each grid offset in an (K,2) array, counted column by column
+    ox,oy = offsets[:,:1],offsets[:,1:]
+    i = np.arange(math.floor(-radius/pitchX)-2,math.ceil(radius/pitchX)+2)
+    x = i*pitchX+ox
+    farX = np.maximum(np.abs(x),np.abs(x+pitchX))
+    #half height of the circle at the far edge of each column
+    h = np.sqrt(np.clip(radius**2-farX**2,0,None))
+    #cells need -h < y and y+pitchY < h
+    n = np.ceil((h-oy)/pitchY-1) - np.floor((-h-oy)/pitchY) - 1
+    return np.where(h>0,np.clip(n,0,None),0).sum(axis=1).astype(int)
+
+def optimizeGrid(chipWidth,chipHeight,radius,sawWidths=(203.2,),steps=64,rotate=True):
+    '''
+    Search grid offsets (steps x steps over one pitch), chip rotation (0 or 90 degrees) and saw widths for the layout
+    with the most whole chips inside a circle of the given radius.
+    Returns (number of chips, grid offset, rotated, saw width). Ties go to the smallest offset, unrotated chips
+    and the earliest saw width in the list
+    '''
+    best = None
+    for sawWidth in sawWidths:
+        for rotated in (rotate and (False,True) or (False,)):
+            pitchX,pitchY = chipWidth+sawWidth,chipHeight+sawWidth
+            if rotated:
+                pitchX,pitchY = pitchY,pitchX
+            u,v = np.meshgrid(np.arange(steps)*pitchX/steps,np.arange(steps)*pitchY/steps,indexing='ij')
+            offsets = np.stack((u.ravel(),v.ravel()),axis=-1)
+            counts = _gridCounts(pitchX,pitchY,radius,offsets)
+            k = np.argmax(counts)
+            if best is None or counts[k] > best[0]:
+                best = (int(counts[k]),tuple(offsets[k].tolist()),rotated,sawWidth)
+    return best
+
 # ===============================================================================
 #  WAFER CLASS  
 #       master class designed to handle all layers, main dxf drawing and stores chips
 # ===============================================================================
 class Wafer:
 
-    def __init__(self,name,path,chipWidth,chipHeight,waferDiameter=50800,padding=2500,sawWidth=203.2,frame=True,markers=True,solid=False,multiLayer=True,singleChipRow=False,singleChipColumn=False):
+    def __init__(self,name,path,chipWidth,chipHeight,waferDiameter=50800,padding=2500,sawWidth=203.2,frame=True,markers=True,solid=False,multiLayer=True,singleChipRow=False,singleChipColumn=False,fillMode='triangles',gridOffset=(0,0),exclusions=(),arrayInserts=False,instanceComponents=False,dedupEntities=False):
         # initialize drawing
         self.fileName = name
         self.path = path
@@ -120,6 +219,12 @@ class Wafer:
         self.multiLayer = multiLayer    #draw in multiple layers?
         self.singleChipRow = singleChipRow #draw only one row of chips? (horizontal row)
         self.singleChipColumn = singleChipColumn #draw only one column of chips? (vertical column)
+        self.fillMode = fillMode        #how solid shapes are filled ('triangles' or 'quads', see Entities.fillModes)
+        self.gridOffset = gridOffset    #shift of the chip grid from the wafer center
+        self.exclusions = list(exclusions) #keep-out rectangles [(x0,y0),(x1,y1)] where no chips are placed
+        self.arrayInserts = arrayInserts #place identical chips / borders / markers on the chip grid as array inserts?
+        self.instanceComponents = instanceComponents #draw repeated components (airbridges, junctions...) as block inserts?
+        self.dedupEntities = dedupEntities #drop entities identical to one already on the chip (see Chip.add)?
         
         # initialize default layers
         self.layerNames = ['0']
@@ -132,6 +237,8 @@ class Wafer:
         self.chipColumns = [] #chip columns
         self.chips = [] #cached chip references
         self.defaultChip = None
+        self.sharedBlocks = {} #blocks used by several chips (see Chip.defineBlock)
+        self.instanceResults = {} #component block name: (final local pose of the structure, local return value)
         
         
     # for changing wafer properties later
@@ -158,6 +265,12 @@ class Wafer:
         self.markers = wafer.markers
         self.solid = wafer.solid              #draw things solid?
         self.multiLayer = wafer.multiLayer    #draw in multiple layers?
+        self.fillMode = wafer.fillMode
+        self.gridOffset = wafer.gridOffset
+        self.exclusions = wafer.exclusions
+        self.arrayInserts = wafer.arrayInserts
+        self.instanceComponents = wafer.instanceComponents
+        self.dedupEntities = wafer.dedupEntities
         
         self.layerColors = wafer.layerColors
         self.layerNums = wafer.layerNums
@@ -166,10 +279,55 @@ class Wafer:
         
         #ignore private vars
     
+    def optimizeLayout(self,sawWidths=None,steps=64,rotate=False):
+        #choose the grid offset, chip orientation and saw width (default: current one) that fit the most whole chips
+        #call before init(). Chip counts don't consider exclusions or single row / column wafers (applied in init())
+        #rotate: also try swapping chip width and height. This changes the chip area, not the drawn chips, so only
+        #use it for square chips or chips drawn for either orientation
+        chipWidth,chipHeight = self.chipX-self.sawWidth,self.chipY-self.sawWidth
+        radius = self.waferDiameter/2 - self.padding
+        #counted the same way as the search
+        before = int(_gridCounts(self.chipX,self.chipY,radius,np.array([self.gridOffset],dtype=float))[0])
+        n,offset,rotated,sawWidth = optimizeGrid(chipWidth,chipHeight,radius,sawWidths or [self.sawWidth],steps,rotate)
+        if n <= before:
+            print('Layout already optimal: '+str(before)+' chips')
+            return before,self.gridOffset,False,self.sawWidth
+        if rotated:
+            chipWidth,chipHeight = chipHeight,chipWidth
+            print('\x1b[33mWarning:\x1b[0m chips rotated in '+self.fileName+', now '+str(chipWidth)+' x '+str(chipHeight))
+        self.sawWidth = sawWidth
+        self.chipX = chipWidth + sawWidth
+        self.chipY = chipHeight + sawWidth
+        self.gridOffset = offset
+        print('Optimized layout: '+str(n)+' chips (was '+str(before)+')')
+        return n,offset,rotated,sawWidth
+    
     def save(self):
-        self.drawing.save()
+        #stream the drawing to disk one entity at a time (same output as self.drawing.save())
+        with open(self.drawing.filename,'w',encoding=self.drawing.ENCODING,errors='replace',buffering=1<<20) as f, fillMode(self.fillMode):
+            writeDXF(self.drawing,f)
         print('Saved as: '+ '\x1b[36m' + self.path + self.fileName + '.dxf'+'\x1b[0m')
     
+    def saveGDS(self):
+        #write the drawing as GDSII (same name, .gds) with GDS layer numbers from self.layerNums
+        fileName = self.path + self.fileName + '.gds'
+        with open(fileName,'wb',buffering=1<<20) as f, fillMode(self.fillMode):
+            writeGDS(self.drawing,f,self.layerNums,libName=self.fileName,topName=self.fileName)
+        print('Saved as: '+ '\x1b[36m' + fileName +'\x1b[0m')
+    
+    def dedupReport(self):
+        #print and return the number of duplicate entities dropped from each chip, by entity type (see dedupEntities)
+        report = {}
+        for chip in self.chips+[self.defaultChip]:
+            #lazy chips which aren't built yet have nothing to report (and shouldn't be built for it)
+            if isinstance(chip,LazyChip):
+                chip = chip.chip
+            if chip is not None and chip.dedupKeys is not None and chip.ID not in report:
+                report[chip.ID] = dict(chip.dedupCounts)
+                print(chip.ID+': '+'\x1b[36m'+str(sum(chip.dedupCounts.values()))+' duplicates dropped'+'\x1b[0m'+
+                      ''.join(', %d %s'%(n,name) for name,n in sorted(chip.dedupCounts.items())))
+        return report
+    
     def lyr(self,layerName):
         return self.multiLayer and layerName or '0'
     
@@ -196,6 +354,14 @@ class Wafer:
             self.addLayer(fillerLayerName, -1)
         self.addLayer(layerName, layerColor)
     
+    def mergeLayers(self,layerNames,layerColors):
+        #add layers from another wafer (eg. used by a chip built elsewhere) which this wafer doesn't have yet
+        for layerName in layerNames:
+            if layerName not in self.layerNames:
+                self.addLayer(layerName,layerColors[layerName])
+                #layer table may already be written by init
+                self.drawing.add_layer(layerName,color=layerColors[layerName])
+    
     def setDefaultChip(self,chip=None):
         # update default chip and chip list
         
@@ -237,46 +403,11 @@ class Wafer:
         if self.frame:
             self.drawing.add(dxf.circle(radius=self.waferDiameter/2,center=(0,0),layer=fr))
             self.drawing.add(dxf.circle(radius=self.waferDiameter/2-self.padding,center=(0,0),layer=fr))
-        #determine number of chips, chip layout and coordinates
-        nx=0
-        ny=0
-        if self.singleChipColumn:
-            if self.singleChipRow:
-                #only one chip on the wafer
-                self.chipPts.append([-0.5*self.chipX,-0.5*self.chipY])
-                self.chipColumns.append(1)
-            else:
-                #vertical column of chips, symmetric about X axis
-                while((ny+1)*self.chipY)**2 + ((0.5)*self.chipX)**2 < (self.waferDiameter/2 - self.padding)**2:
-                    self.chipPts.append([-0.5*self.chipX,ny*self.chipY])
-                    self.chipPts.append([-0.5*self.chipX,(-ny-1)*self.chipY])
-                    ny += 1
-                self.chipColumns.append(2*ny)
-                nx += 1
-        elif self.singleChipRow:
-            #horizontal row of chips, symmetric about Y axis
-            while ((nx+1)*self.chipX)**2 + self.chipY**2 < (self.waferDiameter/2 - self.padding)**2:
-                self.chipPts.append([nx*self.chipX,-0.5*self.chipY])
-                self.chipPts.append([(-nx-1)*self.chipX,-0.5*self.chipY])
-                self.chipColumns.append(1)
-                nx += 1
-        else:
-            #grid of chips, symmetric about X and Y axis
-            while ((nx+1)*self.chipX)**2 + self.chipY**2 < (self.waferDiameter/2 - self.padding)**2:
-                ny=0
-                while((ny+1)*self.chipY)**2 + ((nx+1)*self.chipX)**2 < (self.waferDiameter/2 - self.padding)**2:
-                    self.chipPts.append([nx*self.chipX,ny*self.chipY])
-                    self.chipPts.append([nx*self.chipX,(-ny-1)*self.chipY])
-                    self.chipPts.append([(-nx-1)*self.chipX,ny*self.chipY])
-                    self.chipPts.append([(-nx-1)*self.chipX,(-ny-1)*self.chipY])
-                    ny += 1
-                self.chipColumns.append(2*ny)
-                nx += 1
-        #sort chip indices left to right, then bottom to top
-        self.chipPts.sort()
+        #determine number of chips, chip layout and coordinates (sorted left to right, then bottom to top)
+        pts,self.chipColumns = chipGrid(self.chipX,self.chipY,self.waferDiameter/2 - self.padding,offset=self.gridOffset,
+                                        exclusions=self.exclusions,singleColumn=self.singleChipColumn,singleRow=self.singleChipRow)
+        self.chipPts = pts.tolist()
         print('Number of Chips: '+str(len(self.chipPts)))
-        #reverse column counts to go from left to center
-        self.chipColumns = self.chipColumns[::-1]
         
         self.setDefaultChip()
         
@@ -371,9 +502,8 @@ class Wafer:
         
         self.drawing.blocks.add(border)
 
-        for index,pt in enumerate(self.chipPts):
-            if (maxpts==0 or index<maxpts) and index>=minpts:
-                self.drawing.add(dxf.insert('DICINGBORDER',insert=(pt[0],pt[1]),layer=self.lyr(layer)))
+        indices = [index for index in range(len(self.chipPts)) if (maxpts==0 or index<maxpts) and index>=minpts]
+        self.insertAtChips('DICINGBORDER',indices,self.lyr(layer))
                 
     def writeChip(self,chip,index):
         #insert a chip at specified index
@@ -381,8 +511,42 @@ class Wafer:
         
     #write all chips in the chips buffer
     def populate(self):
+        if not self.arrayInserts:
+            for i,chip in enumerate(self.chips):
+                self.writeChip(chip,i)
+            return
+        groups = {}
         for i,chip in enumerate(self.chips):
-            self.writeChip(chip,i)
+            groups.setdefault((chip.ID,self.lyr(chip.layer)),[]).append(i)
+        for (ID,layer),indices in groups.items():
+            self.insertAtChips(ID,indices,layer,offset=(self.sawWidth/2,self.sawWidth/2))
+    
+    def insertAtChips(self,name,indices,layer,offset=(0,0)):
+        #insert block name at the chip points with the given indices (plus offset)
+        #if self.arrayInserts, chips on the same grid are collapsed into array inserts (columns x rows)
+        pts = [self.chipPts[i] for i in indices]
+        if not self.arrayInserts or len(pts) < 2:
+            for pt in pts:
+                self.drawing.add(dxf.insert(name,insert=(pt[0]+offset[0],pt[1]+offset[1]),layer=layer))
+            return
+        pitch = (self.chipX,self.chipY)
+        origin = np.min(pts,axis=0)
+        grid = np.round((np.array(pts)-origin)/pitch).astype(int)
+        onGrid = np.all(np.abs(origin+grid*pitch-pts) < 1e-6,axis=1)
+        mask = np.zeros(grid.max(axis=0)+1,dtype=bool)
+        mask[grid[onGrid,0],grid[onGrid,1]] = True
+        corners = {(i,j):pt for (i,j),pt,ok in zip(grid.tolist(),pts,onGrid.tolist()) if ok}
+        for (i,j),(cols,rows) in cellRuns(mask):
+            pt = corners[(i,j)]
+            if cols*rows == 1:
+                self.drawing.add(dxf.insert(name,insert=(pt[0]+offset[0],pt[1]+offset[1]),layer=layer))
+            else:
+                self.drawing.add(dxf.insert(name,insert=(pt[0]+offset[0],pt[1]+offset[1]),columns=cols,rows=rows,
+                                            colspacing=pitch[0],rowspacing=pitch[1],layer=layer))
+        #chips off the grid
+        for pt,ok in zip(pts,onGrid.tolist()):
+            if not ok:
+                self.drawing.add(dxf.insert(name,insert=(pt[0]+offset[0],pt[1]+offset[1]),layer=layer))
     
     def setChipBuffer(self,chip,index):
         self.chips[index]=chip
@@ -398,11 +562,15 @@ class Wafer:
     def mark1000(self,markHeight,start,stop,layer):
         width = markHeight/4
         #default spacing is 
+        digits = {}
         for i in range(start,stop+1):
             n=i-start
-            self.drawing.add(dxf.insert('0'+str(n//100),insert=self.chipSpace(vadd((width,width),self.chipPts[i])),layer=self.lyr(layer)))
-            self.drawing.add(dxf.insert('0'+str(n%100//10),insert=self.chipSpace(vadd((width*5,width),self.chipPts[i])),layer=self.lyr(layer)))
-            self.drawing.add(dxf.insert('0'+str(n%10),insert=self.chipSpace(vadd((width*9,width),self.chipPts[i])),layer=self.lyr(layer)))
+            digits.setdefault(('0'+str(n//100),width),[]).append(i)
+            digits.setdefault(('0'+str(n%100//10),width*5),[]).append(i)
+            digits.setdefault(('0'+str(n%10),width*9),[]).append(i)
+        #each digit position is placed at all chips showing the same digit there
+        for (name,x),indices in digits.items():
+            self.insertAtChips(name,indices,self.lyr(layer),offset=self.chipSpace((x,width)))
     
     #return chip centered coordinates in wafer space
     def center(self,xy=(0,0)):
@@ -452,12 +620,14 @@ class Wafer:
             JANGLE2 = JANGLE1 - 90
         self.setupJunctionAngles(self,[JANGLE1 % 360,JANGLE2 % 360])
         
-    def setupXORlayer(self,XLAYER='XOR',xcolor=6):
+    def setupXORlayer(self,XLAYER='XOR',xcolor=6,merge=False):
         '''
         Sets a layer for XOR operations on all other layers. 
         OUT = ( LAYER1 or LAYER2 ... or LAYERN ) xor XLAYER 
+        merge: compute OUT for each chip layer when the chip is saved (Chip.applyXOR), so the file holds the merged layer
         '''
         self.XLAYER=XLAYER
+        self.XORmerge=merge
         self.addLayer(XLAYER, xcolor)
        
     def setupAirbridgeLayers(self,BRLAYER='BRIDGE',RRLAYER='TETHER',brcolor=36,rrcolor=41):
@@ -467,7 +637,1032 @@ class Wafer:
         self.addLayer(RRLAYER,rrcolor)
         self.RRLAYER=RRLAYER
 
+    # --------------------------  Parallel chip builds  ----------------------------------
+    
+    def buildChips(self,specs,post=None,processes=None,cache=None):
+        '''
+        Build several chips at once in a pool of worker processes.
+        specs:      list of (chipClass, args, kwargs) - each chip is built as chipClass(wafer,*args,**kwargs)
+        post:       optional function called as post(chip) in the worker after construction (eg. waffle).
+                    must be picklable (module level function or functools.partial)
+        processes:  number of workers (default: all cores). processes=1 builds in this process
+        cache:      optional ChipCache. cached chips are loaded, only the misses are built
+        
+        Chips built in a worker come back with their blocks already serialized (PrebuiltBlock), so they can be
+        saved / populated as usual, but no longer modified. Layers added by chips are merged back in spec order.
+        Chip classes should be importable by the workers (fork start method handles classes defined in scripts).
+        '''
+        specs = [(spec[0],tuple(spec[1]) if len(spec)>1 else (),dict(spec[2]) if len(spec)>2 else {}) for spec in specs]
+        if cache is not None:
+            chips = [None]*len(specs)
+            keys = [cache.key(self,chipClass,args,kwargs,post) for chipClass,args,kwargs in specs]
+            for i,key in enumerate(keys):
+                chips[i] = cache.load(self,key)
+            todo = [i for i,chip in enumerate(chips) if chip is None]
+            cache.hits += len(specs)-len(todo)
+            cache.misses += len(todo)
+            for i,chip in zip(todo,self.buildChips([specs[i] for i in todo],post=post,processes=processes)):
+                chip.cache = cache
+                chip.cacheKey = keys[i]
+                chips[i] = chip
+            return chips
+        if processes == 1:
+            chips = []
+            for chipClass,args,kwargs in specs:
+                chip = chipClass(self,*args,**kwargs)
+                if post is not None:
+                    post(chip)
+                chips.append(chip)
+            return chips
+        
+        #workers get a copy of the wafer settings, without the drawing or chips
+        state = {k:v for k,v in vars(self).items() if k not in ('drawing','chips','defaultChip','spool')}
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.starmap(_buildChipWorker,[(state,chipClass,args,kwargs,post) for chipClass,args,kwargs in specs])
+        
+        chips = []
+        for chip,layers in results:
+            chip.wafer = self
+            self.mergeLayers(*layers)
+            chips.append(chip)
+        return chips
     
+# ===============================================================================
+#  DXF OUTPUT
+#       streaming writer, and blocks which are already serialized to DXF (used to pass chips back from
+#       worker processes, the chip cache, and spooling chips to disk)
+# ===============================================================================
+
+def _writeEntity(entity,write):
+    write(tags2str(entity))
+    if isinstance(entity,TagCache):
+        #the entity has been written: don't keep its tags around for the rest of the drawing
+        entity.invalidate()
+
+def _writeBlock(block,write):
+    #write a block one entity at a time
+    if isinstance(block,PrebuiltBlock):
+        block.writeTo(write)
+        return
+    block.extension_point()
+    write(tags2str(DXFList([DXFAtom(block.DXF_ENTITY_NAME)]+block.get_attribs())))
+    for entity in block.get_data():
+        _writeEntity(entity,write)
+
+def writeDXF(drawing,fileobj):
+    '''
+    Write a dxfwrite drawing to an open text file, one entity at a time.
+    Output is identical to drawing.save(), without building the tags for whole sections at once
+    '''
+    write = fileobj.write
+    write(tags2str(drawing.header))
+    write(tags2str(drawing.tables))
+    write(tags2str(DXFList((DXFAtom('SECTION'),DXFName('BLOCKS')))))
+    for block in drawing.blocks.blocks.values():
+        _writeBlock(block,write)
+    write(tags2str(DXFList((DXFAtom('ENDSEC'),DXFAtom('SECTION'),DXFName('ENTITIES')))))
+    for entity in drawing.entities.entities:
+        _writeEntity(entity,write)
+    write(tags2str(DXFList((DXFAtom('ENDSEC'),DXFAtom('EOF')))))
+
+class _Spool:
+    #anonymous temporary file holding serialized blocks (one per wafer, so open files don't grow with the chips)
+    def __init__(self):
+        self.file = tempfile.TemporaryFile('w+b')
+    
+    def add(self,block):
+        #append a block, returns its (offset,size) in bytes
+        f = self.file
+        f.seek(0,os.SEEK_END)
+        start = f.tell()
+        _writeBlock(block,lambda text: f.write(text.encode('utf-8')))
+        return start,f.tell()-start
+    
+    def chunks(self,start,size,chunkSize=1<<20):
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for offset in range(start,start+size,chunkSize):
+            self.file.seek(offset)
+            yield decoder.decode(self.file.read(min(chunkSize,start+size-offset)))
+
+class PrebuiltBlock:
+    def __init__(self,name,dxfString=None,spool=None,span=None):
+        self.name = name
+        self.dxfString = dxfString
+        #spooled blocks: (offset,size) of the DXF text in spool
+        self.spool = spool
+        self.span = span
+        
+    @classmethod
+    def fromBlock(cls,block):
+        return cls(block['name'],tags2str(block))
+    
+    @classmethod
+    def spooled(cls,block,spool):
+        #serialize into spool (see _Spool), so the block content doesn't stay in memory
+        return cls(block['name'],spool=spool,span=spool.add(block))
+    
+    def __getitem__(self,key):
+        if key != 'name':
+            raise KeyError(key)
+        return self.name
+    
+    def __dxf__(self):
+        if self.spool is None:
+            return self.dxfString
+        return ''.join(self.spool.chunks(*self.span))
+    
+    def writeTo(self,write):
+        if self.spool is None:
+            write(self.dxfString)
+            return
+        for chunk in self.spool.chunks(*self.span):
+            write(chunk)
+    
+    def __getstate__(self):
+        #spooled blocks are pickled with their content
+        return {'name':self.name,'dxfString':self.__dxf__(),'spool':None,'span':None}
+    
+    def add(self,entity):
+        raise TypeError('Block '+self.name+' has already been built and serialized, it can no longer be modified')
+    
+    def get_data(self):
+        return []
+
+def _buildChipWorker(waferState,chipClass,args,kwargs,post):
+    #construct a chip against a copy of the wafer, then serialize its blocks
+    wafer = Wafer.__new__(Wafer)
+    wafer.__dict__.update(waferState)
+    wafer.drawing = dxf.drawing(wafer.path + wafer.fileName + '.dxf')
+    wafer.chips = []
+    wafer.defaultChip = None
+    chip = chipClass(wafer,*args,**kwargs)
+    if post is not None:
+        post(chip)
+    if getattr(wafer,'XORmerge',False):
+        chip.applyXOR()
+    _freezeChip(chip)
+    chip.wafer = None
+    return chip,(wafer.layerNames,wafer.layerColors)
+
+def _freezeChip(chip,spool=False):
+    #replace chip blocks by serialized copies (in place), optionally spooled to disk (into the wafer's spool file)
+    #shared blocks are frozen in the wafer too, so they are serialized once for all chips
+    wafer = chip.wafer
+    if spool:
+        if getattr(wafer,'spool',None) is None:
+            wafer.spool = _Spool()
+        freeze = lambda block: PrebuiltBlock.spooled(block,wafer.spool)
+    else:
+        freeze = PrebuiltBlock.fromBlock
+    shared = getattr(wafer,'sharedBlocks',{})
+    with fillMode(wafer.fillMode):
+        if not isinstance(chip.chipBlock,PrebuiltBlock):
+            chip.chipBlock = freeze(chip.chipBlock)
+        for name,block in chip.subBlocks.items():
+            if isinstance(block,PrebuiltBlock):
+                continue
+            chip.subBlocks[name] = freeze(block)
+            if shared.get(name) is block:
+                shared[name] = chip.subBlocks[name]
+    chip.polygonCache = None #holds on to the live blocks
+    return chip
+
+# ===============================================================================
+#  BINARY CHIP FORMAT
+#       chip blocks stored as NumPy arrays, one .npy file each so they can be memory-mapped (see Chip.dump, Chip.load)
+#       entities are tables of type / layer / color and a range of tags. Point tags (x,y,z) index into vertices,
+#       string tags into the type, layer or string tables, and numeric tags hold their value
+# ===============================================================================
+
+_binaryArrays = ('meta','size','waferLayers','waferLayerColors','blocks','blockEntities','types','layers','strings',
+                 'entityType','entityLayer','entityColor','entityTags','tagCode','tagValue','vertices')
+_codeType = DXFAtom._dxftype.group_code_type
+
+def _parseTags(text):
+    lines = iter(text.splitlines())
+    for code,value in zip(lines,lines):
+        code = int(code)
+        yield code,DXFAtom._dxftype.cast(value,code)
+
+def _entityTags(obj):
+    for tag in iterdxftags(obj):
+        if isinstance(tag,DXFAtom):
+            yield tag.group_code,tag.value
+        elif isinstance(tag,DXFPoint):
+            for atom in tag.point:
+                yield atom.group_code,atom.value
+        else:
+            #points and other composite tags only know how to write themselves
+            yield from _parseTags(tag.__dxf__())
+
+def _blockTags(block):
+    #(group code, value) of every tag in a block, as written to DXF
+    if isinstance(block,PrebuiltBlock):
+        yield from _parseTags(block.__dxf__())
+        return
+    block.extension_point()
+    yield from _entityTags(DXFList([DXFAtom(block.DXF_ENTITY_NAME)]+block.get_attribs()))
+    for entity in block.get_data():
+        yield from _entityTags(entity)
+
+def _encodeBlocks(blocks):
+    #pack blocks into arrays
+    tables = {0:{},8:{},None:{}} #entity types, layers, other strings
+    def index(code,value):
+        table = tables.get(code,tables[None])
+        return table.setdefault(value,len(table))
+    names,blockEntities = [],[0]
+    entityType,entityLayer,entityColor,entityTags = [],[],[],[]
+    tagCode,tagValue,vertices = [],[],[]
+    for block in blocks:
+        names.append(block['name'])
+        point = None #(x code, vertex) of the last point tag, y and z are merged into it
+        for code,value in _blockTags(block):
+            if point is not None and code in (point[0]+10,point[0]+20) and math.isnan(vertices[point[1]][code//10-1]):
+                vertices[point[1]][code//10-1] = value
+                continue
+            point = None
+            if code == 0:
+                entityType.append(index(0,value))
+                entityLayer.append(-1)
+                entityColor.append(256) #BYLAYER
+                entityTags.append(len(tagCode))
+            elif code == 8:
+                entityLayer[-1] = index(8,value)
+            elif code == 62:
+                entityColor[-1] = value
+            tagCode.append(code)
+            if 10 <= code < 19:
+                point = (code,len(vertices))
+                tagValue.append(len(vertices))
+                vertices.append([value,math.nan,math.nan])
+            elif _codeType(code) == 'string':
+                tagValue.append(index(code,value))
+            else:
+                tagValue.append(value)
+        blockEntities.append(len(entityType))
+    entityTags.append(len(tagCode))
+    return {'blocks':np.array(names,dtype=str),
+            'blockEntities':np.array(blockEntities,dtype=np.int64),
+            'types':np.array(list(tables[0]),dtype=str),
+            'layers':np.array(list(tables[8]),dtype=str),
+            'strings':np.array(list(tables[None]),dtype=str),
+            'entityType':np.array(entityType,dtype=np.int32),
+            'entityLayer':np.array(entityLayer,dtype=np.int32),
+            'entityColor':np.array(entityColor,dtype=np.int16),
+            'entityTags':np.array(entityTags,dtype=np.int64),
+            'tagCode':np.array(tagCode,dtype=np.int16),
+            'tagValue':np.array(tagValue,dtype=np.float64),
+            'vertices':np.array(vertices,dtype=np.float64).reshape(-1,3)}
+
+class MappedBlock(PrebuiltBlock):
+    '''
+    Block read from the binary chip format. DXF text is generated from the (memory-mapped) arrays while writing
+    '''
+    def __init__(self,name,arrays,index):
+        PrebuiltBlock.__init__(self,name)
+        self.arrays = arrays
+        self.index = index
+    
+    def _chunks(self,entitiesPerChunk=4096):
+        a = self.arrays
+        strings = {0:a['types'].tolist(),8:a['layers'].tolist(),None:a['strings'].tolist()}
+        start,stop = a['blockEntities'][self.index:self.index+2].tolist()
+        for first in range(start,stop,entitiesPerChunk):
+            last = min(first+entitiesPerChunk,stop)
+            t0,t1 = a['entityTags'][first:last+1][[0,-1]].tolist()
+            codes,values = a['tagCode'][t0:t1],a['tagValue'][t0:t1]
+            #point tags of a chunk refer to a contiguous run of vertices
+            pointValues = values[(codes >= 10) & (codes < 19)]
+            v0 = len(pointValues) and int(pointValues[0])
+            vertices = a['vertices'][v0:v0+len(pointValues)].tolist()
+            codes,values = codes.tolist(),values.tolist()
+            out = []
+            for code,value in zip(codes,values):
+                if 10 <= code < 19:
+                    x,y,z = vertices[int(value)-v0]
+                    out.append('%3d\n%s\n'%(code,x))
+                    if not math.isnan(y):
+                        out.append('%3d\n%s\n'%(code+10,y))
+                    if not math.isnan(z):
+                        out.append('%3d\n%s\n'%(code+20,z))
+                    continue
+                kind = _codeType(code)
+                if kind == 'string':
+                    value = strings.get(code,strings[None])[int(value)]
+                elif kind != 'float':
+                    value = int(value)
+                out.append('%3d\n%s\n'%(code,value))
+            yield ''.join(out)
+    
+    def __dxf__(self):
+        return ''.join(self._chunks())
+    
+    def writeTo(self,write):
+        for chunk in self._chunks():
+            write(chunk)
+    
+    def __reduce__(self):
+        #pickled (eg. into the chip cache) as plain DXF text
+        return (PrebuiltBlock,(self.name,self.__dxf__()))
+
+# ===============================================================================
+#  GDSII OUTPUT
+#       blocks become cells and inserts become SREF / AREF (insert arrays). Closed polylines, solids and
+#       circles become boundaries, open polylines become paths. Solids following a polyline are its fill and are
+#       skipped. Block entities on layer '0' take the layer of the insert (as in DXF), so these blocks get a copy
+#       of their cell for each layer they are inserted on (named BLOCK$LAYER). Outlines with more points than an XY
+#       record holds are fractured into several boundaries (or paths)
+# ===============================================================================
+
+_gdsUnits = (1e-3,1e-9) #database unit in user units (um) and in meters (1nm grid)
+_gdsMaxPoints = 8191    #largest XY record
+
+def _gdsRecord(rtype,dtype=0,data=b''):
+    return pack('>HBB',4+len(data),rtype,dtype)+data
+
+def _gdsString(rtype,text):
+    data = text.encode('ascii','replace')
+    return _gdsRecord(rtype,6,data+b'\0'*(len(data)%2))
+
+def _gdsReal(x):
+    #8 byte excess-64, base 16 real
+    if x == 0:
+        return bytes(8)
+    sign = x < 0 and 0x80 or 0
+    x = abs(x)
+    exponent = 64
+    while x >= 1:
+        x /= 16
+        exponent += 1
+    while x < 1/16:
+        x *= 16
+        exponent -= 1
+    return bytes([sign|exponent])+int(round(x*2**56)).to_bytes(8,'big')[1:]
+
+def _gdsXY(points):
+    return _gdsRecord(0x10,3,np.round(np.asarray(points,dtype=float)/_gdsUnits[0]).astype('>i4').tobytes())
+
+def _dxfEntities(tags):
+    #group DXF tags into entities ({group code:value}), with the vertices of a POLYLINE in entity['vertices']
+    entity = current = None
+    for code,value in tags:
+        if code == 0:
+            if value == 'VERTEX' and entity is not None and 'vertices' in entity:
+                current = {}
+                entity['vertices'].append(current)
+                continue
+            if value == 'SEQEND':
+                current = None
+                continue
+            if entity is not None:
+                yield entity
+            entity = current = {0:value}
+            if value == 'POLYLINE':
+                entity['vertices'] = []
+        elif current is not None and code not in current:
+            current[code] = value
+    if entity is not None:
+        yield entity
+
+def _entityRecord(entity):
+    #{group code:value} of a plain dxfwrite insert / polyline / solid / circle / line, read from its attributes
+    #without generating tags. None for other entities
+    kind = type(entity)
+    get = lambda key,default: entity[key] if key in entity.attribs else default
+    if kind is Insert and not entity.data:
+        (x,y),(dx,dy) = entity['insert']['xy'],(get('colspacing',0.),get('rowspacing',0.))
+        return {0:'INSERT',8:entity['layer'],2:entity['blockname'],10:x,20:y,41:get('xscale',1.),42:get('yscale',1.),
+                50:get('rotation',0.),70:get('columns',1),71:get('rows',1),44:dx,45:dy}
+    if kind is Polyline:
+        points = [v['location']['xy'] for v in entity.vertices if not isinstance(v,DXFAtom)]
+        return {0:'POLYLINE',8:entity['layer'],70:entity['flags'],40:get('startwidth',0.),'points':points}
+    if kind is Solid and all(i in entity.attribs for i in (0,1,2)):
+        last = 3 in entity.attribs and 3 or 2 #3 point solids repeat the last point
+        record = {0:'SOLID',8:entity['layer']}
+        for i in range(4):
+            #points 2 and 3 are swapped in the DXF (group codes 13 and 12)
+            shift = entity.DXF_ATTRIBUTES[i].group_code
+            record[10+shift],record[20+shift] = entity[min(i,last)]['xy']
+        return record
+    if kind is Circle:
+        (x,y) = entity['center']['xy']
+        return {0:'CIRCLE',8:entity['layer'],10:x,20:y,40:entity['radius']}
+    if kind is Line:
+        (x0,y0),(x1,y1) = entity['start']['xy'],entity['end']['xy']
+        return {0:'LINE',8:entity['layer'],10:x0,20:y0,11:x1,21:y1}
+    return None
+
+def _gdsEntities(entities):
+    #entities of a block or drawing, each as a list of {group code:value} dicts. Shapes with an outline
+    #(Entities.SolidPline and friends, rectangles) and plain dxfwrite shapes skip tag generation
+    for entity in entities:
+        if isinstance(entity,DXFAtom):
+            continue #ENDBLK
+        if hasattr(entity,'outline'):
+            yield [{0:'POLYLINE',8:entity.layer,70:1,'points':entity.outline()}]
+        elif isinstance(entity,Rectangle):
+            entity._calc_corners()
+            yield [{0:'POLYLINE',8:entity.layer,70:1,'points':entity.points}]
+        else:
+            record = _entityRecord(entity)
+            yield record is None and _dxfEntities(_entityTags(entity)) or [record]
+
+def _onOrInside(points,outline,eps=1e-6):
+    #True if all points are inside the closed outline or on its edges (even-odd rule)
+    p,q = outline,np.roll(outline,-1,axis=0)
+    d = q-p
+    for x,y in points:
+        #on an edge
+        t = np.clip(((x-p[:,0])*d[:,0] + (y-p[:,1])*d[:,1])/np.maximum((d**2).sum(axis=1),1e-300),0,1)
+        if np.min((p[:,0]+t*d[:,0]-x)**2 + (p[:,1]+t*d[:,1]-y)**2) <= eps**2:
+            continue
+        crosses = (p[:,1] > y) != (q[:,1] > y)
+        xc = p[crosses,0] + (y-p[crosses,1])*d[crosses,0]/d[crosses,1]
+        if np.count_nonzero(xc > x) % 2 == 0:
+            return False
+    return True
+
+def _prebuiltGroups(entities):
+    #group the entities of a serialized block like _gdsEntities: solids right after a polyline, on its layer and
+    #inside it are its fill (as written by Entities.SolidPline). Any other entity is a group of its own
+    group,outline,vertices = [],None,None
+    for entity in entities:
+        if entity[0] == 'SOLID' and outline is not None and entity.get(8,'0') == group[0].get(8,'0'):
+            corners = _elementPoints(entity)[0]
+            if all(pt in vertices for pt in corners) or _onOrInside(corners,outline):
+                group.append(entity)
+                continue
+        if group:
+            yield group
+        group,outline = [entity],None
+        if entity[0] == 'POLYLINE':
+            points,closed,_ = _elementPoints(entity)
+            if closed and len(points) > 2:
+                outline,vertices = pointArray(points),set(points)
+    if group:
+        yield group
+
+def _blockEntities(block):
+    if isinstance(block,PrebuiltBlock):
+        #already serialized, split into entities again
+        return _prebuiltGroups(_dxfEntities(_blockTags(block)))
+    return _gdsEntities(block.get_data())
+
+def _entityLayer(entity):
+    try:
+        return entity['layer']
+    except (KeyError,TypeError):
+        return next((value for code,value in _entityTags(entity) if code == 8),'0')
+
+def _inheritsLayer(block):
+    #True if the block has entities on layer '0', which are drawn on the layer of each insert
+    if isinstance(block,MappedBlock):
+        layers = block.arrays['layers'].tolist()
+        start,stop = block.arrays['blockEntities'][block.index:block.index+2].tolist()
+        return '0' in layers and bool(np.any(block.arrays['entityLayer'][start+1:stop] == layers.index('0')))
+    if isinstance(block,PrebuiltBlock):
+        text = block.__dxf__()
+        #skip the block header, which is on layer 0 itself
+        return '\n  8\n0\n' in text[text.find('\n  0\n'):]
+    return any(_entityLayer(entity) == '0' for entity in block.get_data() if not isinstance(entity,DXFAtom))
+
+def _elementPoints(entity):
+    #points of a POLYLINE, SOLID, CIRCLE or LINE ({group code:value}) without repeats, as (points, closed, width)
+    #None for other entities
+    kind = entity[0]
+    width,closed = 0.,True
+    if kind == 'POLYLINE':
+        points = entity.get('points') or [(v.get(10,0.),v.get(20,0.)) for v in entity['vertices']]
+        width = entity.get(40,0.)
+        closed = entity.get(70,0) & 1 or (width == 0 and len(points) > 2)
+    elif kind == 'SOLID':
+        points = [(entity.get(10+i,0.),entity.get(20+i,0.)) for i in (0,1,3,2)]
+    elif kind == 'CIRCLE':
+        r,c = entity.get(40,0.),(entity.get(10,0.),entity.get(20,0.))
+        n = max(16,int(math.ceil(2*math.pi*r/max(r*0.01,1.))))
+        points = [(c[0]+r*math.cos(2*math.pi*i/n),c[1]+r*math.sin(2*math.pi*i/n)) for i in range(n)]
+    elif kind == 'LINE':
+        points = [(entity.get(10,0.),entity.get(20,0.)),(entity.get(11,0.),entity.get(21,0.))]
+        closed = False
+    else:
+        return None
+    #drop repeated points
+    points = [pt for i,pt in enumerate(points) if i == 0 or pt != points[i-1]]
+    if closed and len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    return points,closed,width
+
+class _GDSCells:
+    #writes cells to a GDSII stream, keeping track of the per-layer copies of blocks that are needed
+    def __init__(self,drawing,write,layerNums):
+        self.blocks = drawing.blocks.blocks
+        self.write = write
+        self.layerNums = layerNums
+        self.inherits = {}
+        self.variants = []
+        self.written = set()
+        self.unknownLayers = set()
+        self.unknownKinds = set()
+    
+    def layer(self,layerName):
+        if layerName not in self.layerNums:
+            if layerName not in self.unknownLayers:
+                print('\x1b[33mWarning:\x1b[0m layer '+str(layerName)+' has no layer number, written as GDS layer 0')
+                self.unknownLayers.add(layerName)
+            return 0
+        return self.layerNums[layerName]
+    
+    def refName(self,name,layerName):
+        #cell to reference for an insert of block name on layerName
+        if layerName == '0' or name not in self.blocks:
+            return name
+        if name not in self.inherits:
+            self.inherits[name] = _inheritsLayer(self.blocks[name])
+        if not self.inherits[name]:
+            return name
+        if (name,layerName) not in self.written:
+            self.written.add((name,layerName))
+            self.variants.append((name,layerName))
+        return name+'$'+layerName
+    
+    def cell(self,name,groups,inherit='0'):
+        #groups: entities, each as a list of {group code:value} dicts (see _gdsEntities)
+        write = self.write
+        write(_gdsRecord(0x05,2,bytes(24)))
+        write(_gdsString(0x06,name))
+        for group in groups:
+            filled = False #solids right after a polyline are its fill
+            for entity in group:
+                filled = self.element(entity,inherit,filled)
+        write(_gdsRecord(0x07))
+    
+    def element(self,entity,inherit,filled):
+        #write one entity. Returns True after a polyline, whose following solids are its fill
+        kind = entity[0]
+        if kind == 'SOLID' and filled:
+            return True
+        layerName = entity.get(8,'0')
+        if layerName == '0':
+            layerName = inherit
+        if kind == 'INSERT':
+            self.ref(entity,self.refName(entity[2],layerName))
+            return False
+        shape = _elementPoints(entity)
+        if shape is None:
+            #BLOCK / ENDBLK / VIEWPORT, unsupported entities (text, arcs...) are reported once
+            if kind not in ('BLOCK','ENDBLK','VIEWPORT') and kind not in self.unknownKinds:
+                print('\x1b[33mWarning:\x1b[0m '+str(kind)+' entities have no GDSII equivalent, skipped')
+                self.unknownKinds.add(kind)
+            return False
+        points,closed,width = shape
+        if len(points) < (closed and 3 or 2):
+            return kind == 'POLYLINE'
+        pieces = [points]
+        if len(points) >= _gdsMaxPoints:
+            #too many points for one XY record: boundaries are fractured, paths split into pieces sharing their ends
+            if closed:
+                pieces = [toPoints(pts) for pts in polygonBoolean([points],maxPoints=_gdsMaxPoints-1)]
+            else:
+                n = _gdsMaxPoints-1
+                pieces = [points[i:i+n] for i in range(0,len(points)-1,n-1)]
+        write = self.write
+        for pts in pieces:
+            write(_gdsRecord(closed and 0x08 or 0x09))
+            write(_gdsRecord(0x0D,2,pack('>h',self.layer(layerName))))
+            write(_gdsRecord(0x0E,2,pack('>h',0)))
+            if closed:
+                write(_gdsXY(pts+pts[:1]))
+            else:
+                write(_gdsRecord(0x0F,3,pack('>i',int(round(width/_gdsUnits[0])))))
+                write(_gdsXY(pts))
+            write(_gdsRecord(0x11))
+        return kind == 'POLYLINE'
+    
+    def ref(self,entity,name):
+        write = self.write
+        xscale,yscale = entity.get(41,1.),entity.get(42,1.)
+        angle = entity.get(50,0.)
+        cols,rows = entity.get(70,1),entity.get(71,1)
+        origin = (entity.get(10,0.),entity.get(20,0.))
+        write(_gdsRecord(cols*rows > 1 and 0x0B or 0x0A))
+        write(_gdsString(0x12,name))
+        #GDS mirrors about the x axis before rotating, DXF scales x and y separately
+        reflect = (xscale < 0) != (yscale < 0)
+        if xscale < 0:
+            angle += 180
+        if reflect or abs(xscale) != 1 or angle % 360:
+            write(_gdsRecord(0x1A,1,pack('>H',reflect and 0x8000 or 0)))
+            if abs(xscale) != 1:
+                write(_gdsRecord(0x1B,5,_gdsReal(abs(xscale))))
+            if angle % 360:
+                write(_gdsRecord(0x1C,5,_gdsReal(angle % 360)))
+        if cols*rows > 1:
+            a = math.radians(entity.get(50,0.))
+            colX,colY = cols*entity.get(44,0.)*math.cos(a),cols*entity.get(44,0.)*math.sin(a)
+            rowX,rowY = -rows*entity.get(45,0.)*math.sin(a),rows*entity.get(45,0.)*math.cos(a)
+            write(_gdsRecord(0x13,2,pack('>hh',cols,rows)))
+            write(_gdsXY([origin,(origin[0]+colX,origin[1]+colY),(origin[0]+rowX,origin[1]+rowY)]))
+        else:
+            write(_gdsXY([origin]))
+        write(_gdsRecord(0x11))
+
+def writeGDS(drawing,fileobj,layerNums,libName='LIB',topName='TOP'):
+    '''
+    Write a dxfwrite drawing to an open binary file as GDSII: one cell per block, plus a top cell (topName)
+    holding the drawing entities. layerNums maps layer names to GDS layer numbers (eg. Wafer.layerNums)
+    '''
+    write = fileobj.write
+    write(_gdsRecord(0x00,2,pack('>h',600)))
+    write(_gdsRecord(0x01,2,bytes(24)))
+    write(_gdsString(0x02,libName))
+    write(_gdsRecord(0x03,5,_gdsReal(_gdsUnits[0])+_gdsReal(_gdsUnits[1])))
+    cells = _GDSCells(drawing,write,layerNums)
+    for name,block in drawing.blocks.blocks.items():
+        cells.cell(name,_blockEntities(block))
+    cells.cell(topName,_gdsEntities(drawing.entities.entities))
+    #copies of blocks for the layers they were inserted on (may need further copies of nested blocks)
+    while cells.variants:
+        name,layerName = cells.variants.pop()
+        cells.cell(name+'$'+layerName,_blockEntities(cells.blocks[name]),inherit=layerName)
+    write(_gdsRecord(0x04))
+
+# ===============================================================================
+#  CHIP CACHE
+#       persistent cache of built chips, keyed by a hash of everything that goes into building them
+# ===============================================================================
+
+#wafer attributes which don't affect chip contents
+_cacheIgnoredWaferAttrs = ('drawing','chips','defaultChip','chipPts','chipColumns','fileName','path','sharedBlocks','instanceResults','spool','gridOffset','exclusions','arrayInserts')
+
+@lru_cache(maxsize=None)
+def _librarySourceHash():
+    #any change to maskLib itself invalidates all cached chips
+    h = hashlib.sha256()
+    for fname in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)),'*.py'))):
+        with open(fname,'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def _sourceOf(obj):
+    try:
+        return inspect.getsource(obj)
+    except (OSError,TypeError):
+        return getattr(obj,'__module__','')+'.'+getattr(obj,'__qualname__',repr(obj))
+
+def _keyRepr(obj):
+    #stable text representation of chip constructor inputs
+    if obj is None or isinstance(obj,(bool,int,float,complex,str,bytes)):
+        return repr(obj)
+    elif isinstance(obj,(list,tuple)):
+        return type(obj).__name__+'('+','.join(_keyRepr(o) for o in obj)+')'
+    elif isinstance(obj,dict):
+        return '{'+','.join(_keyRepr(k)+':'+_keyRepr(obj[k]) for k in sorted(obj,key=repr))+'}'
+    elif isinstance(obj,(set,frozenset)):
+        return '{'+','.join(sorted(_keyRepr(o) for o in obj))+'}'
+    elif isinstance(obj,functools.partial):
+        return 'partial('+_keyRepr(obj.func)+','+_keyRepr(obj.args)+','+_keyRepr(obj.keywords)+')'
+    elif isinstance(obj,Structure):
+        return 'Structure('+_keyRepr((obj.start,obj.direction,obj.defaults))+')'
+    elif inspect.isclass(obj) or inspect.isroutine(obj):
+        return _sourceOf(obj)
+    elif hasattr(obj,'tolist'):
+        return _keyRepr(obj.tolist())
+    text = repr(obj)
+    if ' at 0x' in text:
+        raise TypeError('cannot build a cache key from '+text)
+    return text
+
+class ChipCache:
+    '''
+    Content addressed on-disk cache of built chips.
+    
+    Build chips with cache.build(wafer,chipClass,*args,post=None,**kwargs) instead of chipClass(wafer,*args,**kwargs).
+    The key hashes the source of the chip class (and its bases), the constructor arguments (including structure
+    defaults), the post function, the wafer settings (layers, chip size, solid ...) and the maskLib source.
+    On a hit the chip is loaded with serialized blocks (PrebuiltBlock) and cannot be modified - put any extra
+    drawing (eg. waffle) in post. On a miss the chip is built normally, and stored when Chip.save is called.
+    
+    Least recently used entries are evicted when the cache grows past maxSize (bytes).
+    '''
+    def __init__(self,path='chipcache/',maxSize=1e9):
+        self.path = path
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        os.makedirs(path,exist_ok=True)
+        
+    def key(self,wafer,chipClass,args=(),kwargs=None,post=None):
+        h = hashlib.sha256()
+        h.update(_librarySourceHash().encode())
+        for cls in inspect.getmro(chipClass):
+            if cls is not object:
+                h.update(_sourceOf(cls).encode())
+        h.update(_keyRepr((args,kwargs or {},post)).encode())
+        h.update(_keyRepr({k:v for k,v in vars(wafer).items() if k not in _cacheIgnoredWaferAttrs}).encode())
+        return h.hexdigest()
+    
+    def _file(self,key):
+        return os.path.join(self.path,key+'.pkl')
+    
+    def load(self,wafer,key):
+        #return the cached chip, or None
+        fname = self._file(key)
+        try:
+            with open(fname,'rb') as f:
+                chip = pickle.load(f)
+        except (OSError,EOFError,pickle.UnpicklingError,AttributeError,ImportError):
+            return None
+        os.utime(fname) #mark as recently used
+        chip.wafer = wafer
+        return chip
+    
+    def build(self,wafer,chipClass,*args,post=None,**kwargs):
+        try:
+            key = self.key(wafer,chipClass,args,kwargs,post)
+        except TypeError as e:
+            print('\x1b[33mWarning:\x1b[0m chip not cached ('+str(e)+')')
+            self.misses += 1
+            chip = chipClass(wafer,*args,**kwargs)
+            if post is not None:
+                post(chip)
+            return chip
+        chip = self.load(wafer,key)
+        if chip is not None:
+            self.hits += 1
+            return chip
+        self.misses += 1
+        chip = chipClass(wafer,*args,**kwargs)
+        if post is not None:
+            post(chip)
+        chip.cache = self
+        chip.cacheKey = key
+        return chip
+        
+    def store(self,chip):
+        #serialize chip blocks and write the chip to the cache. called by Chip.save
+        _freezeChip(chip)
+        wafer, cache, key = chip.wafer, chip.cache, chip.cacheKey
+        chip.wafer = chip.cache = chip.cacheKey = None
+        try:
+            data = pickle.dumps(chip,protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            chip.wafer, chip.cache, chip.cacheKey = wafer, cache, key
+        tmp = self._file(key)+'.tmp'
+        with open(tmp,'wb') as f:
+            f.write(data)
+        os.replace(tmp,self._file(key))
+        self.stores += 1
+        self.evict()
+        
+    def evict(self):
+        #remove least recently used entries until the cache fits in maxSize
+        entries = []
+        for fname in glob.glob(os.path.join(self.path,'*.pkl')):
+            st = os.stat(fname)
+            entries.append((st.st_mtime,st.st_size,fname))
+        total = sum(e[1] for e in entries)
+        for mtime,size,fname in sorted(entries):
+            if total <= self.maxSize:
+                break
+            os.remove(fname)
+            total -= size
+            self.evictions += 1
+    
+    def clear(self):
+        for fname in glob.glob(os.path.join(self.path,'*.pkl')):
+            os.remove(fname)
+    
+    def stats(self):
+        entries = glob.glob(os.path.join(self.path,'*.pkl'))
+        return {'hits':self.hits,'misses':self.misses,'stores':self.stores,'evictions':self.evictions,
+                'entries':len(entries),'size':sum(os.path.getsize(f) for f in entries)}
+    
+    def report(self):
+        st = self.stats()
+        print('Chip cache: '+'\x1b[36m'+str(st['hits'])+' hits, '+str(st['misses'])+' misses'+'\x1b[0m'+
+              ', %d entries (%.1f MB), %d evicted'%(st['entries'],st['size']/1e6,st['evictions']))
+    
+# ===============================================================================
+#  LAZY CHIPS
+#       stand-ins which record drawing calls and only generate geometry when the chip is saved (see Chip.lazy)
+# ===============================================================================
+
+class LazyChip:
+    '''
+    Records a chip constructor and any drawing calls made on it, without running them.
+    The chip is built the first time its geometry is needed: save(), build(), or any attribute of the real chip
+    (structures, chipBlock...). ID, chipID, layer, width, height and center are available without building
+    '''
+    def __init__(self,chipClass,wafer,*args,**kwargs):
+        self.chipClass = chipClass
+        self.args = args
+        self.kwargs = kwargs
+        self.ops = [] #recorded drawing calls (func, args, kwargs), run in order on the built chip
+        self.chip = None
+        try:
+            bound = inspect.signature(chipClass.__init__).bind(None,wafer,*args,**kwargs)
+            bound.apply_defaults()
+            params = bound.arguments
+        except TypeError:
+            params = {}
+        #chips conventionally take (wafer, chipID, layer, ...)
+        self.chipID = params.get('chipID',args[0] if len(args) > 0 else '0')
+        self.layer = params.get('layer',args[1] if len(args) > 1 else '0')
+        self.ID = 'CHIP_'+str(self.chipID)
+        self.wafer = wafer
+        self.width = wafer.chipX - wafer.sawWidth
+        self.height = wafer.chipY - wafer.sawWidth
+        self.center = (self.width/2,self.height/2)
+    
+    def draw(self,func,*args,**kwargs):
+        #record func(chip,*args,**kwargs), eg. lazyChip.draw(CPW_straight,0,100)
+        if self.chip is not None:
+            func(self.chip,*args,**kwargs)
+        else:
+            self.ops.append((func,args,kwargs))
+        return self
+    
+    def add(self,obj,**kwargs):
+        return self.draw(Chip.add,obj,**kwargs)
+    
+    @property
+    def built(self):
+        return self.chip is not None
+    
+    def build(self):
+        #generate the geometry (once) and return the real chip
+        if self.chip is None:
+            chip = self.chipClass(self.wafer,*self.args,**self.kwargs)
+            for func,args,kwargs in self.ops:
+                func(chip,*args,**kwargs)
+            self.ops = []
+            self.chip = chip
+        return self.chip
+    
+    def save(self,wafer,**kwargs):
+        return self.build().save(wafer,**kwargs)
+    
+    def __getattr__(self,name):
+        #anything else needs the real chip
+        if name.startswith('__') or name in ('chip','chipClass','args','kwargs','ops'):
+            raise AttributeError(name)
+        return getattr(self.build(),name)
+
+# ===============================================================================
+#  COMPONENT INSTANCES
+#       components (functions drawing on a chip at a structure) drawn many times with the same parameters are
+#       defined once as a block in their local frame, then placed with an insert (see instanced, Chip.instance)
+# ===============================================================================
+
+def instanced(func=None,rotate=True):
+    '''
+    Decorator for component functions func(chip,structure,...). On chips of a wafer with instanceComponents,
+    calls go through Chip.instance. Pass instance=False (or True) to a call to override the wafer setting.
+    rotate=False for components which depend on the absolute direction (eg. evaporation angles of junctions):
+    those are defined once per direction, and inserted without rotation
+    '''
+    if func is None:
+        return lambda f: instanced(f,rotate=rotate)
+    @functools.wraps(func)
+    def wrapper(chip,structure,*args,instance=None,**kwargs):
+        if instance is None:
+            instance = isinstance(chip,Chip) and getattr(chip.wafer,'instanceComponents',False)
+        if instance:
+            return chip.instance(func,structure,*args,rotate=rotate,**kwargs)
+        return func(chip,structure,*args,**kwargs)
+    return wrapper
+
+def _instanceKey(obj):
+    #arguments with numpy arrays replaced by their content (array reprs are truncated), for hashing with repr
+    if isinstance(obj,np.ndarray):
+        return ('ndarray',obj.shape,obj.dtype.str,hashlib.md5(np.ascontiguousarray(obj).tobytes()).hexdigest())
+    elif isinstance(obj,(tuple,list)):
+        return type(obj)(_instanceKey(o) for o in obj)
+    elif isinstance(obj,dict):
+        return sorted((k,_instanceKey(v)) for k,v in obj.items())
+    return obj
+
+class _LocalPose:
+    #a structure in a component's frame, without the chip it was drawn on
+    def __init__(self,structure):
+        self.start = structure.start
+        self.direction = structure.direction
+        self.defaults = structure.defaults.copy()
+
+def _localPose(obj):
+    #structures in a component's return value are stored as _LocalPose
+    if isinstance(obj,Structure):
+        return _LocalPose(obj)
+    elif isinstance(obj,(tuple,list)):
+        return type(obj)(_localPose(o) for o in obj)
+    return obj
+
+def _globalPose(obj,chip,frame):
+    #inverse of _localPose, placing the stored structures relative to frame
+    if isinstance(obj,_LocalPose):
+        return Structure(chip,start=frame.getPos(obj.start),direction=frame.direction+obj.direction,defaults=obj.defaults.copy())
+    elif isinstance(obj,(tuple,list)):
+        return type(obj)(_globalPose(o,chip,frame) for o in obj)
+    return obj
+
+# ===============================================================================
+#  GEOMETRY DEDUP
+#       entities identical to one already on a chip (same type, layer, colors and outline) can be dropped
+#       when added (Wafer dedupEntities). Outlines are compared regardless of starting vertex and direction
+# ===============================================================================
+
+def _normalizedOutline(points):
+    #outline rounded to 1e-6, without closing point, starting at the smallest vertex, in the smaller direction
+    pts = np.round(np.asarray(points,dtype=np.float64)[:,:2],6) + 0.
+    if len(pts) > 1 and np.array_equal(pts[0],pts[-1]):
+        pts = pts[:-1]
+    if len(pts) == 0:
+        return pts
+    start = np.lexsort((pts[:,1],pts[:,0]))[0]
+    forward = np.roll(pts,-start,axis=0)
+    backward = np.roll(forward[::-1],1,axis=0)
+    differ = np.flatnonzero(forward.ravel() != backward.ravel())
+    if len(differ) and backward.ravel()[differ[0]] < forward.ravel()[differ[0]]:
+        return backward
+    return forward
+
+def _geometryKey(entity):
+    #hashable key of an entity's geometry, or None if it can't be compared (it is then always kept)
+    if hasattr(entity,'outline'):
+        points = entity.outline()
+    elif isinstance(entity,Rectangle):
+        entity._calc_corners()
+        points = entity.points
+    elif isinstance(entity,_Entity) and not getattr(entity,'data',None):
+        #plain dxfwrite entities (inserts, text, solids...) without sub-entities: compare the DXF itself
+        return (type(entity).__name__,dxfstr(entity))
+    else:
+        return None
+    return (type(entity).__name__,entity.layer,entity.color,getattr(entity,'bgcolor',None),getattr(entity,'linetype',None),
+            _normalizedOutline(points).tobytes())
+
+# ===============================================================================
+#  LAYER BOOLEANS
+#       chip geometry flattened to polygons per layer (inserts expanded, solid fills skipped), and layers combined
+#       with polygon booleans (utilities.polygonBoolean), so eg. the XOR layer is applied before the file is
+#       written instead of in the CAD tool afterwards (see Chip.booleanLayers, Chip.applyXOR)
+# ===============================================================================
+
+def _flatPolygons(groups,blocks,memo,out,inherit='0'):
+    #add the closed outlines of entity groups (see _gdsEntities) to out ({layer:[(N,2) arrays]}), entities on layer
+    #'0' are on the inherit layer. Blocks are flattened once into memo, in their own coordinates (keeping layer '0')
+    for group in groups:
+        filled = False #solids right after a polyline are its fill
+        for entity in group:
+            kind = entity[0]
+            layer = entity.get(8,'0')
+            if layer == '0':
+                layer = inherit
+            if kind == 'INSERT':
+                _flatInsert(entity,layer,blocks,memo,out)
+            elif not (kind == 'SOLID' and filled):
+                shape = _elementPoints(entity)
+                if shape is not None and shape[1] and len(shape[0]) > 2:
+                    out.setdefault(layer,[]).append(pointArray(shape[0]))
+                elif shape is not None and shape[2]:
+                    print('\x1b[33mWarning:\x1b[0m wide open polyline on layer '+str(layer)+' skipped')
+            filled = kind == 'POLYLINE' or (kind == 'SOLID' and filled)
+
+def _flatInsert(entity,layer,blocks,memo,out):
+    #add the outlines of an insert (all array copies) to out. Block outlines on layer '0' take the insert layer
+    name = entity[2]
+    if name not in memo:
+        memo[name] = {}
+        if name in blocks:
+            _flatPolygons(_blockEntities(blocks[name]),blocks,memo,memo[name])
+    insert = (entity.get(10,0.),entity.get(20,0.))
+    scale = (entity.get(41,1.),entity.get(42,1.))
+    rotation = math.radians(entity.get(50,0.))
+    offsets = [(i*entity.get(44,0.),j*entity.get(45,0.)) for i in range(entity.get(70,1)) for j in range(entity.get(71,1))]
+    #array copies are the placed block shifted by the rotated spacing
+    shifts = transformPoints(offsets,rotation=rotation)
+    for blockLayer,polygons in memo[name].items():
+        dest = out.setdefault(blockLayer == '0' and layer or blockLayer,[])
+        for pts in polygons:
+            placed = transformPoints(pts*scale,insert,rotation)
+            dest.extend(placed + shift for shift in shifts)
+
+def _flatArrays(polygons):
+    #list of (N,2) arrays as one read-only vertex buffer and offsets: polygon k is vertices[offsets[k]:offsets[k+1]]
+    offsets = np.zeros(len(polygons)+1,dtype=np.int64)
+    offsets[1:] = np.cumsum([len(pts) for pts in polygons])
+    vertices = np.concatenate(polygons) if polygons else np.zeros((0,2))
+    vertices.flags.writeable = offsets.flags.writeable = False
+    return vertices,offsets
+
+def _chipStamp(chip):
+    #changes whenever entities are added to the chip block or its blocks, or the chip block is replaced
+    blocks = [chip.chipBlock] + list(chip.subBlocks.values())
+    return tuple((block,len(getattr(block,'data',()))) for block in blocks)
+
 # ===============================================================================
 #  CHIP CLASS  
 #       basic class with a blank chip
@@ -484,6 +1679,13 @@ class Chip:
     #cached chip propoerties
     solid = 1
     frame = 1
+    #set when built through a ChipCache
+    cache = None
+    cacheKey = None
+    #geometry keys of the entities on the chip, if duplicates are dropped (Wafer dedupEntities)
+    dedupKeys = None
+    #(chip state, polygon arrays) of the last polygonArrays call
+    polygonCache = None
     def __init__(self,wafer,chipID,layer,structures=None,defaults=None, FRAME_NAME='FRAME'):
         self.wafer = wafer
         self.width = wafer.chipX - wafer.sawWidth
@@ -501,6 +1703,11 @@ class Chip:
         self.center = (self.width/2,self.height/2)
         #initialize the block
         self.chipBlock = dxf.block(self.ID)
+        #blocks inserted by the chip (eg. repeated cells), saved along with the chip block
+        self.subBlocks = {}
+        if getattr(wafer,'dedupEntities',False):
+            self.dedupKeys = set()
+            self.dedupCounts = {} #dropped duplicates by entity type
         
         #setup structures
         if structures is not None:
@@ -510,13 +1717,31 @@ class Chip:
         if wafer.frame:
             self.add(dxf.rectangle((0,0),self.width,self.height,layer=wafer.lyr(FRAME_NAME)))
     
-    def save(self,wafer,drawCopyDXF=False,dicingBorder=True,center=False, FRAME_LAYER=['FRAME',8,-1], MARKER_LAYER=['MARKERS',5,-1]):
+    @classmethod
+    def lazy(cls,wafer,*args,**kwargs):
+        #same arguments as the constructor, but geometry is only generated when the chip is saved (see LazyChip)
+        return LazyChip(cls,wafer,*args,**kwargs)
+    
+    def save(self,wafer,drawCopyDXF=False,dicingBorder=True,center=False, FRAME_LAYER=['FRAME',8,-1], MARKER_LAYER=['MARKERS',5,-1],spool=False):
+        #spool: serialize the chip to a temporary file now and free its entities (chip can't be modified afterwards)
+        if getattr(wafer,'XORmerge',False) and not isinstance(self.chipBlock,PrebuiltBlock):
+            self.applyXOR()
+        if spool:
+            _freezeChip(self,spool=True)
+        if self.cacheKey is not None:
+            #freshly built chip, serialize blocks once and store them
+            self.cache.store(self)
+            self.cacheKey = None
+        for block in self.subBlocks.values():
+            wafer.drawing.blocks.add(block)
         wafer.drawing.blocks.add(self.chipBlock)
         if drawCopyDXF:
             #make a copy DXF with only the chip
             temp_wafer = Wafer(wafer.fileName+'_'+self.ID,wafer.path,10,10)
             #height and width don't matter since the next line copies all settings
             temp_wafer.copyPropertiesFrom(wafer)
+            for block in self.subBlocks.values():
+                temp_wafer.drawing.blocks.add(block)
             temp_wafer.drawing.blocks.add(self.chipBlock)
             temp_wafer.initChipOnly(center=center, FRAME_LAYER=FRAME_LAYER, MARKER_LAYER=MARKER_LAYER)
             if dicingBorder:
@@ -526,8 +1751,49 @@ class Chip:
             temp_wafer.save()
         return self
         
+    def dump(self,path):
+        #write the chip blocks in the binary chip format, to a directory of .npy files
+        os.makedirs(path,exist_ok=True)
+        with fillMode(self.wafer.fillMode):
+            arrays = _encodeBlocks(list(self.subBlocks.values())+[self.chipBlock])
+        arrays['meta'] = np.array([str(self.chipID),self.ID,self.layer],dtype=str)
+        arrays['size'] = np.array([self.width,self.height])
+        arrays['waferLayers'] = np.array(self.wafer.layerNames,dtype=str)
+        arrays['waferLayerColors'] = np.array([self.wafer.layerColors[l] for l in self.wafer.layerNames],dtype=np.int16)
+        for name in _binaryArrays:
+            np.save(os.path.join(path,name+'.npy'),arrays[name],allow_pickle=False)
+        return self
+    
+    @classmethod
+    def load(cls,wafer,path):
+        #read a chip written by dump (arrays are memory-mapped). The chip can be saved and populated, but not modified
+        arrays = {name:np.load(os.path.join(path,name+'.npy'),mmap_mode='r',allow_pickle=False) for name in _binaryArrays}
+        chipID,ID,layer = arrays['meta'].tolist()
+        chip = cls.__new__(cls)
+        chip.wafer = wafer
+        chip.chipID = chipID
+        chip.ID = ID
+        chip.layer = layer
+        chip.width,chip.height = arrays['size'].tolist()
+        chip.center = (chip.width/2,chip.height/2)
+        chip.solid = wafer.solid
+        chip.frame = wafer.frame
+        chip.defaults = {}
+        blocks = [MappedBlock(name,arrays,i) for i,name in enumerate(arrays['blocks'].tolist())]
+        chip.chipBlock = blocks[-1]
+        chip.subBlocks = {block.name:block for block in blocks[:-1]}
+        wafer.mergeLayers(arrays['waferLayers'].tolist(),dict(zip(arrays['waferLayers'].tolist(),arrays['waferLayerColors'].tolist())))
+        return chip
+    
     def add(self,obj,structure=None,length=None,offsetVector=None,absolutePos=None,angle=0,newDir=None):
-        self.chipBlock.add(obj)
+        key = self.dedupKeys is not None and _geometryKey(obj)
+        if not key:
+            self.chipBlock.add(obj)
+        elif key in self.dedupKeys:
+            self.dedupCounts[key[0]] = self.dedupCounts.get(key[0],0) + 1
+        else:
+            self.dedupKeys.add(key)
+            self.chipBlock.add(obj)
         def struct():
             if isinstance(structure,Structure):
                 return structure
@@ -542,6 +1808,125 @@ class Chip:
         elif absolutePos is not None:
             struct().updatePos(newStart=absolutePos, angle=angle, newDir=newDir)
         
+    #define a block local to this chip (name is prefixed with the chip ID), or return it if it already exists
+    #shared blocks keep their name and are defined once per wafer, for use by all chips (eg. text glyphs)
+    #entities can then be placed with dxf.insert(block['name'],...)
+    def defineBlock(self,name,entities=(),shared=False):
+        if shared:
+            registry = self.wafer.sharedBlocks
+        else:
+            name = self.ID+'_'+name
+            registry = self.subBlocks
+        if name not in registry:
+            block = dxf.block(name)
+            for e in entities:
+                block.add(e)
+            registry[name] = block
+        self.subBlocks[name] = registry[name]
+        return self.subBlocks[name]
+        
+    #draw func(chip,structure,*args,**kwargs) once as a block shared by all chips, and insert it at the structure
+    #the structure is moved as func would have moved it, and structures returned by func are placed accordingly
+    #tuple structures are passed to func as (0,0), and the block is inserted there without rotation
+    def instance(self,func,structure,*args,rotate=True,**kwargs):
+        if isinstance(structure,tuple):
+            frame,local = Structure(None,structure),(0,0)
+            defaults = self.defaults
+        else:
+            if not isinstance(structure,Structure):
+                structure = self.structures[structure]
+            frame = Structure(None,structure.start,rotate and structure.direction or 0)
+            local = Structure(None,direction=structure.direction-frame.direction,defaults=structure.defaults)
+            defaults = structure.defaults
+        #junction angles are the only wafer setting components read besides layers
+        key = repr((func.__module__,func.__qualname__,_instanceKey(args),_instanceKey(kwargs),_instanceKey(defaults),
+                    not isinstance(local,tuple) and local.direction,getattr(self.wafer,'JANGLES',None)))
+        name = 'COMP_'+func.__name__+'_'+hashlib.md5(key.encode()).hexdigest()[:12]
+        results = self.wafer.instanceResults
+        if name not in self.wafer.sharedBlocks or name not in results:
+            #draw into a copy of the chip whose block is the component block
+            block = dxf.block(name)
+            proxy = copy.copy(self)
+            proxy.chipBlock = block
+            if proxy.dedupKeys is not None:
+                proxy.dedupKeys = set() #the block has its own coordinates
+            if isinstance(local,Structure):
+                local.chip = proxy
+            ret = func(proxy,local,*args,**kwargs)
+            results[name] = (_localPose(local),_localPose(ret))
+            self.defineBlock(name,block.data,shared=True)
+        else:
+            self.defineBlock(name,shared=True)
+        pose,ret = results[name]
+        self.add(dxf.insert(name,insert=frame.start,rotation=frame.direction))
+        if isinstance(structure,Structure):
+            structure.updatePos(newStart=frame.getPos(pose.start),newDir=frame.direction+pose.direction)
+        return _globalPose(ret,self,frame)
+        
+    #closed outlines on the chip as {layer:(vertices,offsets)}, polygon k of a layer being vertices[offsets[k]:offsets[k+1]]
+    #in chip coordinates, with inserts flattened (text and open polylines are skipped). Entities on layer '0' are on
+    #the chip layer. Read from entity parameters (no DXF tags are built for common entities), and cached until
+    #entities are added to the chip or its blocks (entities changed in place are not noticed). layers: only return these
+    def polygonArrays(self,layers=None):
+        stamp = _chipStamp(self)
+        if self.polygonCache is None or self.polygonCache[0] != stamp:
+            out = {}
+            _flatPolygons(_blockEntities(self.chipBlock),self.subBlocks,{},out,self.wafer.lyr(self.layer))
+            self.polygonCache = (stamp,{layer:_flatArrays(polygons) for layer,polygons in out.items()})
+        arrays = self.polygonCache[1]
+        if layers is not None:
+            return {layer:arrays.get(layer) or _flatArrays([]) for layer in layers}
+        return dict(arrays)
+    
+    #closed outlines on the chip as {layer:[(N,2) arrays]}, see polygonArrays
+    def layerPolygons(self,layers=None):
+        return {layer:[vertices[i:j] for i,j in zip(offsets[:-1],offsets[1:])]
+                for layer,(vertices,offsets) in self.polygonArrays(layers).items()}
+    
+    #replace the geometry on layers and others by (layers) operation (others), drawn on outLayer (default: first of
+    #layers). operation: 'or', 'and', 'not' (layers minus others) or 'xor' (see utilities.polygonBoolean)
+    #entities with nothing on these layers are kept as they are, inserts which have something are flattened
+    def booleanLayers(self,layers,others=(),operation='or',outLayer=None):
+        if isinstance(self.chipBlock,PrebuiltBlock):
+            raise TypeError('Block '+self.chipBlock.name+' has already been built and serialized, it can no longer be modified')
+        if outLayer is None:
+            outLayer = layers[0]
+        operands = set(layers) | set(others)
+        a,b,kept = [],[],[]
+        memo = {}
+        for entity in self.chipBlock.get_data():
+            if isinstance(entity,DXFAtom):
+                continue #ENDBLK
+            flat = {}
+            _flatPolygons(_gdsEntities([entity]),self.subBlocks,memo,flat,self.wafer.lyr(self.layer))
+            if operands.isdisjoint(flat):
+                kept.append(entity)
+                continue
+            for layer,polygons in flat.items():
+                if layer in layers:
+                    a.extend(polygons)
+                if layer in others:
+                    b.extend(polygons)
+                if layer not in operands:
+                    kept.extend(SolidPline((0,0),points=toPoints(pts),bgcolor=self.wafer.bg(layer),layer=layer) for pts in polygons)
+        pieces = polygonBoolean(a,b,operation,maxPoints=_gdsMaxPoints-1,fill=True)
+        self.chipBlock = dxf.block(self.ID)
+        if self.dedupKeys is not None:
+            self.dedupKeys = set()
+        for entity in kept:
+            self.add(entity)
+        bg = self.wafer.bg(outLayer)
+        for outline,trapezoids in pieces:
+            self.add(SolidPline((0,0),points=toPoints(outline),bgcolor=bg,layer=outLayer,fill=[toPoints(t) for t in trapezoids]))
+        return self
+    
+    #OUT = ( LAYER1 or LAYER2 ... or LAYERN ) xor XLAYER (see Wafer.setupXORlayer), drawn on outLayer (default: the
+    #chip layer). layers default to the chip layer, so other masks (eg. junction layers) are left alone
+    def applyXOR(self,layers=None,outLayer=None):
+        if layers is None:
+            layers = [self.layer]
+        return self.booleanLayers(layers,[self.wafer.XLAYER],'xor',outLayer or self.layer)
+        
     #return chip centered coordinates in chip space
     def centered(self,xy=(0,0)):
         return (xy[0]+self.center[0],xy[1]+self.center[1])
@@ -585,6 +1970,17 @@ class Chip:
 #       Coordinate system. keeps track of current location and direction, as well as any defaults
 # ===============================================================================    
 
+@lru_cache(maxsize=4096)
+def _dirVector(angleDeg):
+    #(cos,sin) of an angle in degrees. Structures only ever point in a handful of directions, so cache them
+    angle = math.radians(angleDeg)
+    return (math.cos(angle),math.sin(angle))
+
+def _rotateDeg(vector,angleDeg):
+    #same as rotate_2d, but with angle in degrees and cached trig
+    c,s = _dirVector(angleDeg)
+    return (vector[0]*c - vector[1]*s, vector[1]*c + vector[0]*s)
+
 class Structure:
     #start = current coordinates, direction is angle of +x axis in degrees
     
@@ -622,35 +2018,40 @@ class Structure:
     
     def shiftPos(self, distance, angle=0, newDir=None):
         #move by a specified distance, set new direction
-        self.updatePos(newStart = vadd(self.start,rotate_2d((distance,0),math.radians(self.direction))),angle=angle,newDir=newDir)
+        c,s = _dirVector(self.direction)
+        self.updatePos(newStart = (self.start[0]+distance*c,self.start[1]+distance*s),angle=angle,newDir=newDir)
         
     def getPos(self,vector=None,distance=None,angle=0):
         #return global position from local position based on current location and direction
         if vector is not None:
-            return vadd(self.start,rotate_2d(vector,math.radians(self.direction)))
+            return vadd(self.start,_rotateDeg(vector,self.direction))
         elif distance is not None:
-            return vadd(self.start,rotate_2d((distance,0),math.radians(angle+self.direction)))
+            return vadd(self.start,_rotateDeg((distance,0),angle+self.direction))
         else:
             return self.start
+    
+    def getPositions(self,vectors):
+        #batched getPos: return (N,2) array of global positions for a list / array of local vectors
+        return transformPoints(vectors,self.start,math.radians(self.direction))
         
     def getLastPos(self,vector=None,distance=None,angle=0):
         #return global position from local position based on previous location and direction
         if vector is not None:
-            return vadd(self.last,rotate_2d(vector,math.radians(self.last_direction)))
+            return vadd(self.last,_rotateDeg(vector,self.last_direction))
         elif distance is not None:
-            return vadd(self.last,rotate_2d((distance,0),math.radians(angle+self.last_direction)))
+            return vadd(self.last,_rotateDeg((distance,0),angle+self.last_direction))
         else:
             return self.last
         
     def getGlobalPos(self,pos=(0,0)):
         #return local position from global position based on current location and direction
         localPos = vsub(pos,self.start)
-        return rotate_2d(localPos,-math.radians(self.direction))
+        return _rotateDeg(localPos,-self.direction)
     
     def getLastGlobalPos(self,pos=(0,0)):
         #return local position from global position based on previous location and direction
         localPos = vsub(pos,self.last)
-        return rotate_2d(localPos,-math.radians(self.last_direction))
+        return _rotateDeg(localPos,-self.last_direction)
     
     def clone(self,defaults=None):
         return Structure(self.chip,start=self.start,direction=self.direction,defaults=defaults is not None and defaults or self.defaults)
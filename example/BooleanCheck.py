@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Regression check for polygon booleans (utilities.polygonBoolean, Chip.applyXOR)
+
+Compares the area of every operation against the expected area for identical, nested and touching operands,
+checks that the trapezoid fills cover the outlines, and saves a chip whose XOR layer matches its metal exactly
+with XOR merging on
+
+Run from any directory with maskLib on the path:
+    python BooleanCheck.py
+"""
+import math
+import tempfile
+
+import numpy as np
+from dxfwrite import DXFEngine as dxf
+
+import maskLib.MaskLib as m
+from maskLib.utilities import polygonBoolean
+
+# ===============================================================================
+# operands and expected areas
+# ===============================================================================
+
+def square(x,y,w,h):
+    return [(x,y),(x+w,y),(x+w,y+h),(x,y+h)]
+
+def area(pts):
+    x,y = np.asarray(pts,dtype=float).T
+    return 0.5*(np.dot(x,np.roll(y,-1)) - np.dot(y,np.roll(x,-1)))
+
+t = np.linspace(0,2*math.pi,100,endpoint=False)
+shapes = [square(0,0,100,100),square(200,0,50,80),np.column_stack([500+40*np.cos(t),40*np.sin(t)])]
+shapesArea = sum(area(p) for p in shapes)
+
+cases = [
+    #name, a, b, {operation: expected area}
+    ('identical',shapes,shapes,{'or':shapesArea,'and':shapesArea,'not':0,'xor':0}),
+    ('nested',[square(0,0,100,100)],[square(10,10,20,20)],{'or':10000,'and':400,'not':9600,'xor':9600}),
+    ('nested reversed',[square(10,10,20,20)],[square(0,0,100,100)],{'or':10000,'and':400,'not':0,'xor':9600}),
+    ('touching side',[square(0,0,100,100)],[square(100,0,100,100)],{'or':20000,'and':0,'not':10000,'xor':20000}),
+    ('touching top',[square(0,0,100,100)],[square(0,100,100,100)],{'or':20000,'and':0,'not':10000,'xor':20000}),
+    ('touching corner',[square(0,0,100,100)],[square(100,100,100,100)],{'or':20000,'and':0,'not':10000,'xor':20000}),
+    ]
+
+def check(name,a,b,expected):
+    for operation,expect in expected.items():
+        pieces = polygonBoolean(a,b,operation,fill=True)
+        got = sum(area(outline) for outline,_ in pieces)
+        filled = sum(area(q) for _,trapezoids in pieces for q in trapezoids)
+        assert abs(got-expect) < 1e-6*max(expect,1), '%s %s: area %g, expected %g'%(name,operation,got,expect)
+        assert abs(filled-got) < 1e-6*max(got,1), '%s %s: fill area %g, outline area %g'%(name,operation,filled,got)
+    print('%-16s ok'%name)
+
+# ===============================================================================
+# chip with XOR layer identical to the metal
+# ===============================================================================
+
+def check_chip(path):
+    w = m.Wafer('BooleanCheck',path,7000,7000,solid=True)
+    w.SetupLayers([['BASEMETAL',4]])
+    w.setupXORlayer(merge=True)
+    w.initChipOnly()
+    chip = m.Chip(w,'XOR','BASEMETAL')
+    for layer in ['BASEMETAL','XOR']:
+        chip.add(dxf.rectangle((100,100),500,300,bgcolor=w.bg(layer),layer=layer))
+    chip.save(w)
+    assert not chip.layerPolygons(['BASEMETAL'])['BASEMETAL'], 'metal xor itself should be empty'
+    print('%-16s ok'%'xor chip')
+
+if __name__ == '__main__':
+    for case in cases:
+        check(*case)
+    with tempfile.TemporaryDirectory() as tmp:
+        check_chip(tmp+'/')
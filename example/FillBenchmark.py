@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for solid fill modes (Wafer fillMode)
+
+Writes the same solid-filled chip with fillMode='triangles' (one SOLID per fan triangle) and
+fillMode='quads' (pairs of fan triangles merged into quadrangle SOLIDs), and compares
+file size, number of SOLID entities and write time
+
+Run from any directory with maskLib on the path:
+    python FillBenchmark.py
+"""
+import os
+import tempfile
+import time
+
+from dxfwrite import const
+
+import maskLib.MaskLib as m
+from maskLib.Entities import RoundRect, CurveRect, InsideCurve
+
+# ===============================================================================
+# chip full of curved, solid filled shapes
+# ===============================================================================
+
+def build_chip(w,n=30):
+    chip = m.Chip(w,'FILL','BASEMETAL')
+    pitch = chip.width/n
+    bg = w.bg('BASEMETAL')
+    for x in range(n):
+        for y in range(n):
+            pos = (x*pitch,y*pitch)
+            if (x+y)%3 == 0:
+                chip.add(RoundRect(pos,pitch*0.8,pitch*0.5,pitch*0.2,ptDensity=120,bgcolor=bg,layer='BASEMETAL'))
+            elif (x+y)%3 == 1:
+                chip.add(CurveRect(pos,pitch*0.3,pitch*0.2,ralign=const.TOP,ptDensity=120,bgcolor=bg,layer='BASEMETAL'))
+            else:
+                chip.add(InsideCurve(pos,pitch*0.3,ptDensity=120,bgcolor=bg,layer='BASEMETAL'))
+    return chip
+
+def bench(path,mode):
+    w = m.Wafer('FillBenchmark_'+mode,path,7000,7000,solid=True,fillMode=mode)
+    w.SetupLayers([['BASEMETAL',4]])
+    w.initChipOnly()
+    w.setDefaultChip(build_chip(w))
+    w.populate()
+    t = time.time()
+    w.save()
+    t = time.time()-t
+    fname = path+'FillBenchmark_'+mode+'.dxf'
+    with open(fname) as f:
+        solids = sum(1 for line in f if line == 'SOLID\n')
+    print('%-10s write %5.2fs   file %6.2f MB   %6d SOLIDs'%(mode,t,os.path.getsize(fname)/1e6,solids))
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ['triangles','quads']:
+            bench(tmp+'/',mode)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for GDSII output (Wafer.saveGDS)
+
+Writes the same waffled, solid-filled wafer with Wafer.save() (DXF) and Wafer.saveGDS(), and compares
+write time and file size
+
+Run from any directory with maskLib on the path:
+    python GDSBenchmark.py
+"""
+import os
+import tempfile
+import time
+
+from dxfwrite import const
+
+import maskLib.MaskLib as m
+from maskLib.microwaveLib import waffle
+from maskLib.Entities import RoundRect, CurveRect
+
+# ===============================================================================
+# waffled chip with curved, solid filled shapes
+# ===============================================================================
+
+def build_chip(w,i,n=12):
+    chip = m.Chip(w,'GDS%d'%i,'BASEMETAL')
+    pitch = chip.width/n
+    bg = w.bg('BASEMETAL')
+    for x in range(n):
+        for y in range(n):
+            pos = (x*pitch,y*pitch)
+            if (x+y+i)%2:
+                chip.add(RoundRect(pos,pitch*0.6,pitch*0.4,pitch*0.1,ptDensity=120,bgcolor=bg,layer='BASEMETAL'))
+            else:
+                chip.add(CurveRect(pos,pitch*0.2,pitch*0.3,ralign=const.TOP,ptDensity=120,bgcolor=bg,layer='BASEMETAL'))
+    waffle(chip,50,width=10,layer='BASEMETAL')
+    return chip
+
+def build_wafer(path,nchips=4):
+    w = m.Wafer('GDSBenchmark',path,7000,7000,waferDiameter=m.waferDiameters['4in'],sawWidth=m.sawWidths['8A'],solid=True)
+    w.SetupLayers([['BASEMETAL',4]])
+    w.init()
+    w.DicingBorder()
+    for i in range(nchips):
+        chip = build_chip(w,i)
+        chip.save(w)
+        for j in range(i,len(w.chips),nchips):
+            w.setChipBuffer(chip,j)
+    w.populate()
+    return w
+
+def bench(w,fmt):
+    t = time.time()
+    if fmt == 'dxf':
+        w.save()
+    else:
+        w.saveGDS()
+    t = time.time()-t
+    size = os.path.getsize(w.path+w.fileName+'.'+fmt)
+    print('%-4s write %6.2fs   file %7.2f MB'%(fmt,t,size/1e6))
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp:
+        w = build_wafer(tmp+'/')
+        #GDS first, so it doesn't profit from entity tags cached by the DXF writer
+        for fmt in ['gds','dxf']:
+            bench(w,fmt)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the array geometry kernel (utilities.transformPoints)
+
+Compares the old point-by-point transform (dxfwrite vadd / rotate_2d) against the batched
+NumPy transform, then times entity tag generation and a full run of StructuresTest.py
+
+Run from any directory with maskLib on the path:
+    python GeometryBenchmark.py
+"""
+import math
+import os
+import runpy
+import tempfile
+import timeit
+
+from dxfwrite import const
+from dxfwrite.vector2d import vadd
+from dxfwrite.algebra import rotate_2d
+
+from maskLib.utilities import transformPoints, toPoints
+from maskLib.Entities import CurveRect, RoundRect
+
+# ===============================================================================
+# point transform kernel
+# ===============================================================================
+
+def transform_pointwise(points,insert,rotation):
+    #reference: the old per-point transform used by SolidPline and friends
+    return [vadd(insert,rotate_2d(point,rotation)) for point in points]
+
+def transform_batched(points,insert,rotation):
+    return toPoints(transformPoints(points,insert,rotation))
+
+def bench_kernel(npts=120,repeat=2000):
+    pts = [(math.cos(i),math.sin(i)) for i in range(npts)]
+    t_old = timeit.timeit(lambda: transform_pointwise(pts,(100.,200.),0.3),number=repeat)
+    t_new = timeit.timeit(lambda: transform_batched(pts,(100.,200.),0.3),number=repeat)
+    print('transform %d pts x%d:   pointwise %.3fs   batched %.3fs   (x%.1f)'%(npts,repeat,t_old,t_new,t_old/t_new))
+
+# ===============================================================================
+# entity tag generation
+# ===============================================================================
+
+def bench_entities(repeat=200):
+    def build():
+        CurveRect((10,10),5,50,angle=90,ptDensity=120,rotation=30,bgcolor=const.BYLAYER).__dxftags__()
+        RoundRect((10,10),100,40,10,rotation=30,bgcolor=const.BYLAYER).__dxftags__()
+    t = timeit.timeit(build,number=repeat)
+    print('CurveRect + RoundRect tags x%d:   %.3fs'%(repeat,t))
+
+# ===============================================================================
+# full example
+# ===============================================================================
+
+def bench_structures_test():
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),'StructuresTest.py')
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.mkdir('DXF')
+        try:
+            t = timeit.timeit(lambda: runpy.run_path(script,run_name='__main__'),number=1)
+        finally:
+            os.chdir(cwd)
+    print('StructuresTest.py:   %.2fs'%t)
+
+if __name__ == '__main__':
+    bench_kernel()
+    bench_entities()
+    bench_structures_test()
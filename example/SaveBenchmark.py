@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for writing wafers to DXF
+
+Compares dxfwrite's drawing.save() against the streaming writer used by Wafer.save(), and
+against spooling each chip to disk as soon as it is saved (Chip.save(spool=True)).
+Reports wall time and peak Python memory (tracemalloc) for building + saving a synthetic wafer
+
+Run from any directory with maskLib on the path:
+    python SaveBenchmark.py
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+
+from dxfwrite import DXFEngine as dxf
+
+import maskLib.MaskLib as m
+
+# ===============================================================================
+# synthetic wafer: every chip is a dense grid of rectangles
+# ===============================================================================
+
+def build_chip(w,i,n=50):
+    chip = m.Chip(w,'BENCH%d'%i,'BASEMETAL')
+    pitch = chip.width/n
+    for x in range(n):
+        for y in range(n):
+            chip.add(dxf.rectangle((x*pitch,y*pitch),pitch/2,pitch/2,bgcolor=w.bg(),layer='BASEMETAL'))
+    return chip
+
+def run(path,mode,nchips=8):
+    w = m.Wafer('SaveBenchmark_'+mode,path,7000,7000,waferDiameter=m.waferDiameters['4in'],sawWidth=m.sawWidths['8A'])
+    w.SetupLayers([['BASEMETAL',4]])
+    w.init()
+    for i in range(nchips):
+        chip = build_chip(w,i)
+        chip.save(w,spool=(mode=='spooled'))
+        w.setChipBuffer(chip,i)
+        del chip
+    w.populate()
+    if mode=='dxfwrite':
+        w.drawing.save()
+    else:
+        w.save()
+    return os.path.getsize(path+'SaveBenchmark_'+mode+'.dxf')
+
+def bench(mode):
+    with tempfile.TemporaryDirectory() as tmp:
+        tracemalloc.start()
+        t = time.time()
+        size = run(tmp+'/',mode)
+        t = time.time()-t
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    print('%-10s %6.2fs   peak %7.1f MB   file %6.1f MB'%(mode,t,peak/1e6,size/1e6))
+
+if __name__ == '__main__':
+    for mode in ['dxfwrite','streaming','spooled']:
+        bench(mode)
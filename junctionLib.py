@@ -15,7 +15,7 @@ from dxfwrite.vector2d import vadd
 from dxfwrite.algebra import rotate_2d
 
 from maskLib.Entities import SolidPline, CurveRect, RoundRect, InsideCurve, MiterJoint
-from maskLib.microwaveLib import Strip_straight, Strip_taper, Strip_pad, Strip_stub_round, Strip_stub_open, CPW_taper, CPW_straight, CPW_stub_round
+from maskLib.microwaveLib import Strip_straight, Strip_taper, Strip_pad, Strip_stub_open, CPW_taper, CPW_straight, CPW_stub_round
 
 from maskLib.utilities import curveAB, kwargStrip
 
@@ -355,6 +355,7 @@ def JSingleProbePad(chip,pos,padwidth=250,padheight=None,padradius=25,tab=False,
                 chip.add(dxf.rectangle(struct().start,padwidth-tablength,2*tabhwidth,valign=const.MIDDLE,rotation=struct().direction,bgcolor=bgcolor,**kwargStrip(kwargs)))
             
             
+@m.instanced
 def JProbePads(chip,structure,padwidth=250,separation=40,rotation=0,**kwargs):
     #cache the structure locally. needed since we call structure methods (shiftPos) on the structure
     thisStructure = None
@@ -376,6 +377,7 @@ def JProbePads(chip,structure,padwidth=250,separation=40,rotation=0,**kwargs):
     struct().updatePos(pos) #shift back to where we started        
     
     
+@m.instanced(rotate=False)
 def ManhattanJunction(chip,structure,rotation=0,separation=40,jpadw=20,jpadr=2,jpadh=None,jpadOverhang=5,jpadTaper=0,
                       jfingerw=0.13,jfingerl=5.0,jfingerex=1.0,
                       leadw=2.0,leadr=0.5,
@@ -1286,6 +1288,7 @@ def manhattan_squid_curvy(chip,structure,pad=7,jsep=20,leadw=13,palmw=2,palml=6,
         Strip_straight(chip, s_l, undercut, w=2*fingerw,layer=ULAYER)
         Strip_straight(chip, s_r, undercut, w=2*finger2w,layer=ULAYER)
 
+@m.instanced(rotate=False)
 def DolanJunction(
     chip, structure, junctionl, jfingerw=0.5, rotation=0,
     jarmw=3, jpadw=15, jpadl=20, jpadr=0,jpadoverhang=5, # dimensions for contact tab overlap
@@ -9,6 +9,8 @@ from dxfwrite import DXFEngine as dxf
 from dxfwrite import const
 from dxfwrite.vector2d import vadd
 
+import hashlib
+
 import maskLib.MaskLib as m
 from maskLib.utilities import kwargStrip
 from maskLib.Entities import SolidPline
@@ -105,9 +107,23 @@ alphanum_dict = {
 '.': [[(4,0),(8,0),(8,4),(4,4)]]
 }
 
+def glyphBlock(chip, letter, size, **kwargs):
+    """
+    Block with the outline of a single character at size (x, y), defined once per wafer and shared by all chips.
+    """
+    letter = letter.lower()
+    #entity properties (layer, colors...) and the exact size are part of the block, so they go in the name too
+    #(%g keeps only 6 digits of the size)
+    style = hashlib.md5(repr((float(size[0]),float(size[1]),sorted(kwargs.items()))).encode()).hexdigest()[:8]
+    name = ('GLYPH_%d_%gx%g_%s'%(ord(letter),size[0],size[1],style)).replace('.','p').replace('-','m')
+    scaled_size = (size[0] / 16., size[1] / 16.)
+    return chip.defineBlock(name,(SolidPline(insert=(0,0), points=[(p[0]*scaled_size[0], p[1]*scaled_size[1]) for p in pts], **kwargs)
+                                  for pts in alphanum_dict[letter]),shared=True)
+
 def AlphaNumStr(chip, structure, string, size, centered=False, **kwargs):
     """
     Draws block letters with size (x, y).
+    On chips each character is an insert of a shared glyph block (see glyphBlock)
     """
     if isinstance(structure,m.Structure):
         struct= structure
@@ -122,9 +138,13 @@ def AlphaNumStr(chip, structure, string, size, centered=False, **kwargs):
     for letter in string:
         letter = letter.lower()
         assert letter in alphanum_dict.keys()
-        scaled_size = (size[0] / 16., size[1] / 16.)
-        for pts in alphanum_dict[letter]:
-            scaled_pts = [(p[0]*scaled_size[0], p[1]*scaled_size[1]) for p in pts]
-            chip.add(SolidPline(insert=struct.getPos(), rotation=struct.direction, points=scaled_pts, **kwargs))
+        if isinstance(chip,m.Chip):
+            glyph = glyphBlock(chip, letter, size, **kwargs)
+            chip.add(dxf.insert(glyph['name'], insert=struct.getPos(), rotation=struct.direction, **kwargStrip(kwargs)))
+        else:
+            scaled_size = (size[0] / 16., size[1] / 16.)
+            for pts in alphanum_dict[letter]:
+                scaled_pts = [(p[0]*scaled_size[0], p[1]*scaled_size[1]) for p in pts]
+                chip.add(SolidPline(insert=struct.getPos(), rotation=struct.direction, points=scaled_pts, **kwargs))
         struct.shiftPos(size[0])
-    
\ No newline at end of file
+    
@@ -18,16 +18,14 @@ from dxfwrite.vector2d import vadd, midpoint ,vsub, vector2angle, magnitude, dis
 from dxfwrite.algebra import rotate_2d
 
 from maskLib.Entities import SolidPline, SkewRect, CurveRect, RoundRect, InsideCurve
-from maskLib.utilities import kwargStrip, curveAB
+from maskLib.utilities import kwargStrip, curveAB, toPoints, rasterizePolygon, dilateMask, cellRuns, getChordTolerance, chordSegments, unitArc
 
-from copy import deepcopy
-from matplotlib.path import Path
-from matplotlib.transforms import Bbox
 import math
+import numpy as np
 from copy import copy
 
 # ===============================================================================
-# perforate the ground plane with a grid of squares, which avoid any polylines 
+# perforate the ground plane with a grid of squares, which avoid any shapes on the chip
 # ===============================================================================
 #TODO move to MaskLib
 
@@ -38,7 +36,7 @@ def waffle(chip, grid_x, grid_y=None,width=10,height=None,exclude=None,padx=0,pa
     if exclude is None:
         exclude = ['FRAME']
     else:
-        exclude.append('FRAME')
+        exclude = list(exclude) + ['FRAME']
         
     if grid_y is None:
         grid_y = grid_x
@@ -50,58 +48,28 @@ def waffle(chip, grid_x, grid_y=None,width=10,height=None,exclude=None,padx=0,pa
         pady=padx
         
     nx, ny = list(map(int, [(chip.width) / grid_x, (chip.height) / grid_y]))
-    occupied = [[False]*ny for i in range(nx)]
-    for i in range(nx):
-        occupied[i][0] = True
-        occupied[i][-1] = True
-    for i in range(ny):
-        occupied[0][i] = True
-        occupied[-1][i] = True
+    #occupancy grid indexed [x][y], chip border is always occupied
+    occupied = np.zeros((nx,ny),dtype=bool)
+    occupied[:,0] = occupied[:,-1] = True
+    occupied[0,:] = occupied[-1,:] = True
     
-    for e in chip.chipBlock.get_data():
-        if isinstance(e.__dxftags__()[0], Polyline):
-            if e.layer not in exclude:
-                o_x_list = []
-                o_y_list = []
-                plinePts = [v.__getitem__('location').__getitem__('xy') for v in e.__dxftags__()[0].get_data()]
-                plinePts.append(plinePts[0])
-                for p in plinePts:
-                    o_x, o_y = list(map(int, (p[0] / grid_x, p[1] / grid_y)))
-                    if 0 <= o_x < nx and 0 <= o_y < ny:
-                        o_x_list.append(o_x)
-                        o_y_list.append(o_y)
-                        
-                        #this will however ignore a rectangle with corners outside the chip...
-                if o_x_list:
-                    path = Path([[pt[0]/grid_x,pt[1]/grid_y] for pt in plinePts],closed=True)
-                    for x in range(min(o_x_list)-1, max(o_x_list)+2):
-                        for y in range(min(o_y_list)-1, max(o_y_list)+2):
-                            try:
-                                if path.contains_point([x+.5,y+.5]):
-                                    occupied[x][y]=True
-                                elif path.intersects_bbox(Bbox.from_bounds(x,y,1.,1.),filled=True):
-                                    occupied[x][y]=True
-                            except IndexError:
-                                pass
-       
-
-    second_pass = deepcopy(occupied)
-    for r in range(radius):
-        for i in range(nx):
-            for j in range(ny):
-                if occupied[i][j]:
-                    for ip, jp in [(i+1,j), (i-1,j), (i,j+1), (i,j-1)]:
-                        try:
-                            second_pass[ip][jp] = True
-                        except IndexError:
-                            pass
-        occupied = deepcopy(second_pass)
-   
-    for i in range(int(padx/grid_x),nx-int(padx/grid_x)):
-        for j in range(int(pady/grid_y),ny-int(pady/grid_y)):
-            if not second_pass[i][j]:
-                pos = i*grid_x + grid_x/2., j*grid_y + grid_y/2.
-                chip.add(dxf.rectangle(pos,width,height,bgcolor=chip.wafer.bg(layer),halign=const.CENTER,valign=const.MIDDLE,layer=layer) )   
+    for polyLayer,(vertices,offsets) in chip.polygonArrays().items():
+        if polyLayer not in exclude:
+            #scan convert the polygons into the grid (includes polygons with corners outside the chip)
+            vertices = vertices/(grid_x,grid_y)
+            for i,j in zip(offsets[:-1],offsets[1:]):
+                rasterizePolygon(occupied,vertices[i:j])
+    
+    occupied = dilateMask(occupied,radius)
+    
+    #one hole block, placed with array inserts over runs of free cells
+    hole = chip.defineBlock(('WAFFLE_%s_%gx%g'%(layer,width,height)).replace('.','p'),
+                            [dxf.rectangle((0,0),width,height,bgcolor=chip.wafer.bg(layer),halign=const.CENTER,valign=const.MIDDLE,layer=layer)])
+    i0, j0 = int(padx/grid_x), int(pady/grid_y)
+    free = ~occupied[i0:nx-i0,j0:ny-j0]
+    for (i,j),(cols,rows) in cellRuns(free):
+        pos = (i+i0)*grid_x + grid_x/2., (j+j0)*grid_y + grid_y/2.
+        chip.add(dxf.insert(hole['name'],insert=pos,columns=cols,rows=rows,colspacing=grid_x,rowspacing=grid_y,layer=layer))
                 
     return chip
 
@@ -210,6 +178,7 @@ def Strip_stub_open(chip,structure,flipped=False,curve_out=True,r_out=None,w=Non
     
     
     if r_out > 0:
+        if length is None: length=0
         dx = 0.
         if flipped:
             if allow_oversize:
@@ -221,8 +190,6 @@ def Strip_stub_open(chip,structure,flipped=False,curve_out=True,r_out=None,w=Non
             l=r_out
         else:
             l=min(w/2,r_out)
-        
-        if length is None: length=0
 
         chip.add(RoundRect(struct().getPos((dx,0)),max(length,l),w,l,roundCorners=[0,curve_out,curve_out,0],hflip=flipped,valign=const.MIDDLE,rotation=struct().direction,bgcolor=bgcolor,**kwargs),structure=structure,length=max(l,length))
     else:
@@ -557,7 +524,7 @@ def CPW_stub_round(chip,structure,w=None,s=None,round_left=True,round_right=True
             chip.add(InsideCurve(struct().getPos((flipped and s or w/2,-w/2)),w/2,rotation=struct().direction,hflip=flipped,vflip=True,bgcolor=bgcolor,**kwargs))
             chip.add(dxf.rectangle(struct().getPos((s+w/2-dx,-w/2)),-s,w/2,rotation=struct().direction,halign = flipped and const.RIGHT or const.LEFT, bgcolor=bgcolor,**kwargStrip(kwargs)),structure=structure,length=s+w/2)
     
-def CPW_bend(chip,structure,angle=90,CCW=True,w=None,s=None,radius=None,ptDensity=120,bondwires=False,incl_end_bond=True,bond_pitch=70,bgcolor=None,**kwargs):
+def CPW_bend(chip,structure,angle=90,CCW=True,w=None,s=None,radius=None,ptDensity=120,bondwires=False,incl_end_bond=True,bond_pitch=70,bgcolor=None,tolerance=None,**kwargs):
     def struct():
         if isinstance(structure,m.Structure):
             return structure
@@ -591,8 +558,8 @@ def CPW_bend(chip,structure,angle=90,CCW=True,w=None,s=None,radius=None,ptDensit
 
     startstruct = struct().clone()
         
-    chip.add(CurveRect(struct().start,s,radius,angle=angle,ptDensity=ptDensity,roffset=w/2,ralign=const.BOTTOM,rotation=struct().direction,vflip=not CCW,bgcolor=bgcolor,**kwargs))
-    chip.add(CurveRect(struct().start,s,radius,angle=angle,ptDensity=ptDensity,roffset=-w/2,ralign=const.TOP,valign=const.TOP,rotation=struct().direction,vflip=not CCW,bgcolor=bgcolor,**kwargs))
+    chip.add(CurveRect(struct().start,s,radius,angle=angle,ptDensity=ptDensity,roffset=w/2,ralign=const.BOTTOM,rotation=struct().direction,vflip=not CCW,bgcolor=bgcolor,tolerance=tolerance,**kwargs))
+    chip.add(CurveRect(struct().start,s,radius,angle=angle,ptDensity=ptDensity,roffset=-w/2,ralign=const.TOP,valign=const.TOP,rotation=struct().direction,vflip=not CCW,bgcolor=bgcolor,tolerance=tolerance,**kwargs))
     struct().updatePos(newStart=struct().getPos((radius*math.sin(angleRadians),(CCW and 1 or -1)*radius*(math.cos(angleRadians)-1))),angle=CCW and -angle or angle)
 
     if bondwires: # bond parameters patched through kwargs
@@ -972,6 +939,45 @@ def CPW_directTo(chip,from_structure,to_structure,to_flipped=True,w=None,s=None,
 
 #Various wiggles (meander) definitions 
 
+def _wiggle_turns(length,maxWidth,radius,w,s,nTurns,start_bend,stop_bend):
+    #smallest number of turns >= nTurns for which a meander of given length fits in maxWidth
+    #h(n) = (length-c)/(4n) - pi*radius/2 decreases with n, so solve h(n)+radius+w/2+s/2 <= maxWidth for n directly
+    c = (start_bend+stop_bend)*(math.pi/2-1)*radius
+    K = maxWidth - radius - w/2 - s/2 + math.pi*radius/2
+    fits = lambda n: (length - n*2*math.pi*radius - c)/(4*n)+radius+w/2+s/2 <= maxWidth
+    if K <= 0:
+        #h(n) never gets small enough (the incremental search would never stop)
+        print('\x1b[33mWarning:\x1b[0m meander cannot fit in maxWidth=',maxWidth,' with radius=',radius)
+        return nTurns
+    n = max(nTurns,int(math.ceil((length-c)/(4*K))))
+    #guard against rounding at the boundary
+    while n > nTurns and fits(n-1):
+        n = n-1
+    while not fits(n):
+        n = n+1
+    return n
+
+def wiggle_calc_array(length,maxWidth,radius,w,s=0,nTurns=1,start_bend=True,stop_bend=True):
+    '''
+    Vectorized wiggle_calc for length constrained meanders: size a whole array of lengths at once.
+    length, maxWidth, radius, w, s broadcast against each other
+    returns {'nTurns','h','length','maxWidth'} with arrays, same values as wiggle_calc gives element by element
+    '''
+    length,maxWidth,radius,w,s = np.broadcast_arrays(*[np.asarray(x,dtype=np.float64) for x in (length,maxWidth,radius,w,s)])
+    n0 = max(int(nTurns),1)
+    c = (start_bend+stop_bend)*(math.pi/2-1)*radius
+    K = maxWidth - radius - w/2 - s/2 + math.pi*radius/2
+    h = lambda n: (length - n*2*math.pi*radius - c)/(4*n)
+    fits = lambda n: h(n)+radius+w/2+s/2 <= maxWidth
+    with np.errstate(divide='ignore',invalid='ignore'):
+        n = np.where(K > 0,np.maximum(np.ceil((length-c)/(4*np.where(K > 0,K,1))),n0),n0).astype(int)
+    #guard against rounding at the boundary
+    n = np.where((n > n0) & fits(np.maximum(n-1,1)),n-1,n)
+    n = np.where((K > 0) & ~fits(n),n+1,n)
+    if np.any(~fits(n)):
+        print('\x1b[33mWarning:\x1b[0m',int(np.sum(~fits(n))),'meanders cannot fit in maxWidth')
+    return {'nTurns':n,'h':np.maximum(h(n),radius),'length':length,'maxWidth':maxWidth}
+
 def wiggle_calc(chip,structure,h=None,length=None,nTurns=None,maxWidth=None,Width=None,start_bend = True,stop_bend=True,w=None,s=None,radius=None,debug=False,**kwargs):
     #figure out 
     def struct():
@@ -1023,8 +1029,8 @@ def wiggle_calc(chip,structure,h=None,length=None,nTurns=None,maxWidth=None,Widt
                     maxWidth = min(maxWidth,Width)
             else:
                 maxWidth = Width
-            while h+radius+w/2+s/2>maxWidth:
-                nTurns = nTurns+1
+            if h+radius+w/2+s/2>maxWidth:
+                nTurns = _wiggle_turns(length,maxWidth,radius,w,s,nTurns,start_bend,stop_bend)
                 h = (length - nTurns*2*math.pi*radius - (start_bend+stop_bend)*(math.pi/2-1)*radius)/(4*nTurns)
     else: #length is not contrained
         if h is None:
@@ -1034,7 +1040,7 @@ def wiggle_calc(chip,structure,h=None,length=None,nTurns=None,maxWidth=None,Widt
     h = max(h,radius)
     return {'nTurns':nTurns,'h':h,'length':length,'maxWidth':maxWidth,'Width':Width}
 
-def CPW_wiggles(chip,structure,h=None,length=None,nTurns=None,maxWidth=None,CCW=True,start_bend = True,stop_bend=True,w=None,s=None,radius=None,bgcolor=None,debug=False,**kwargs):
+def CPW_wiggles(chip,structure,h=None,length=None,nTurns=None,maxWidth=None,CCW=True,start_bend = True,stop_bend=True,w=None,s=None,radius=None,bgcolor=None,debug=False,merged=False,**kwargs):
     def struct():
         if isinstance(structure,m.Structure):
             return structure
@@ -1057,6 +1063,10 @@ def CPW_wiggles(chip,structure,h=None,length=None,nTurns=None,maxWidth=None,CCW=
     if debug:
         chip.add(dxf.rectangle(struct().start,(nTurns*4 + start_bend + stop_bend)*radius,2*h,valign=const.MIDDLE,rotation=struct().direction,layer='FRAME'))
         chip.add(dxf.rectangle(struct().start,(nTurns*4 + start_bend + stop_bend)*radius,2*maxWidth,valign=const.MIDDLE,rotation=struct().direction,layer='FRAME'))
+    if merged:
+        #draw each gap as one polygon
+        CPW_path(chip,structure,w=w,s=s,radius=radius,bgcolor=bgcolor,**kwargs).wiggles(h=h,nTurns=nTurns,CCW=CCW,start_bend=start_bend,stop_bend=stop_bend,radius=radius).draw()
+        return
     if start_bend:
         CPW_bend(chip,structure,angle=90,CCW=CCW,w=w,s=s,radius=radius,bgcolor=bgcolor,**kwargs)
         if h > radius:
@@ -1084,6 +1094,164 @@ def CPW_wiggles(chip,structure,h=None,length=None,nTurns=None,maxWidth=None,CCW=
     else:
         CPW_straight(chip,structure,radius,w=w,s=s,bgcolor=bgcolor,**kwargs)
 
+_maxPathStations = 2000 #stations per gap polygon of a CPW_path, keeps polygons within the GDSII vertex limit
+
+class CPW_path:
+    '''
+    CPW route builder: accumulates straights, tapers, bends and wiggles along a structure like the CPW_ functions,
+    but draws each gap as a single polygon (one SolidPline per side) instead of one entity per segment.
+    The structure is updated exactly as the equivalent CPW_ calls would.
+    
+        with CPW_path(chip,s1) as path:
+            path.straight(100)
+            path.bend(angle=90,CCW=False)
+            path.wiggles(length=3000,maxWidth=200)
+    
+    or call path.draw() when done.
+    '''
+    def __init__(self,chip,structure,w=None,s=None,radius=None,ptDensity=120,bgcolor=None,tolerance=None,**kwargs):
+        if isinstance(structure,m.Structure):
+            self.struct = structure
+        elif isinstance(structure,tuple):
+            self.struct = m.Structure(chip,structure)
+        else:
+            self.struct = chip.structure(structure)
+        self.chip = chip
+        defaults = self.struct.defaults
+        if w is None:
+            try:
+                w = defaults['w']
+            except KeyError:
+                print('\x1b[33mw not defined in ',chip.chipID,'!\x1b[0m')
+        if s is None:
+            try:
+                s = defaults['s']
+            except KeyError:
+                print('\x1b[33ms not defined in ',chip.chipID,'!\x1b[0m')
+        if radius is None:
+            radius = defaults.get('radius')
+        if bgcolor is None:
+            bgcolor = chip.wafer.bg()
+        self.w = w
+        self.s = s
+        self.radius = radius
+        self.ptDensity = ptDensity
+        self.tolerance = tolerance
+        self.bgcolor = bgcolor
+        self.kwargs = kwargs
+        #gap edges, in order along the path: [left inner, left outer, right inner, right outer]
+        self.edges = [[],[],[],[]]
+        self._straight = False
+        self._addStation(self.struct,(0,0))
+        
+    def _offsets(self,w,s):
+        return (w/2, w/2+s, -w/2, -w/2-s)
+    
+    def _addStation(self,struct,pos):
+        #add a cross section at local position pos of struct
+        for edge,d in zip(self.edges,self._offsets(self.w,self.s)):
+            edge.append(struct.getPos((pos[0],pos[1]+d)))
+    
+    def straight(self,length):
+        if self._straight:
+            #collinear with the last straight, just move the end points
+            for edge in self.edges:
+                edge.pop()
+        self.struct.shiftPos(length)
+        self._addStation(self.struct,(0,0))
+        self._straight = True
+        return self
+    
+    def taper(self,length=None,w1=None,s1=None):
+        if w1 is None:
+            w1 = self.w
+        if s1 is None:
+            s1 = self.s
+        #if undefined, make outer angle 30 degrees
+        if length is None:
+            length = math.sqrt(3)*abs(self.w/2+self.s-w1/2-s1)
+        self.struct.shiftPos(length)
+        self.w, self.s = w1, s1
+        self._addStation(self.struct,(0,0))
+        self._straight = False
+        return self
+    
+    def bend(self,angle=90,CCW=True,radius=None,ptDensity=None,tolerance=None):
+        if radius is None:
+            radius = self.radius
+        if radius is None:
+            print('\x1b[33mradius not defined in ',self.chip.chipID,'!\x1b[0m')
+            return self
+        if ptDensity is None:
+            ptDensity = self.ptDensity
+        while angle < 0:
+            angle = angle + 360
+        angle = angle%360
+        tolerance = getChordTolerance(tolerance if tolerance is not None else self.tolerance)
+        if tolerance is None:
+            segments = max(int(ptDensity*angle/360),1)
+        else:
+            #the outer gap edge has the largest radius
+            segments = chordSegments(radius+self.w/2+self.s,math.radians(angle),tolerance)
+        cos, sin = unitArc(math.radians(angle),segments)[1:].T
+        t = CCW and -1 or 1 #side the bend turns to
+        start = self.struct.clone()
+        for edge,d in zip(self.edges,self._offsets(self.w,self.s)):
+            local = np.column_stack(((radius - t*d)*sin,t*radius - (t*radius - d)*cos))
+            edge.extend(toPoints(start.getPositions(local)))
+        self.struct.updatePos(newStart=self.struct.getPos((radius*math.sin(math.radians(angle)),-t*radius*(math.cos(math.radians(angle))-1))),angle=CCW and -angle or angle)
+        self._straight = False
+        return self
+    
+    def wiggles(self,h=None,length=None,nTurns=None,maxWidth=None,CCW=True,start_bend=True,stop_bend=True,radius=None):
+        #same meander as CPW_wiggles
+        if radius is None:
+            radius = self.radius
+        params = wiggle_calc(self.chip,self.struct,h,length,nTurns,maxWidth,None,start_bend,stop_bend,self.w,self.s,radius)
+        [nTurns,h,length]=[params[key] for key in ['nTurns','h','length']]
+        if (length is None) or (h is None) or (nTurns is None):
+            print('not enough params specified for CPW_path.wiggles!')
+            return self
+        if start_bend:
+            self.bend(90,CCW,radius)
+            if h > radius:
+                self.straight(h-radius)
+        else:
+            self.straight(h)
+        for n in range(nTurns):
+            if n > 0:
+                self.straight(h+radius)
+            self.bend(180,not CCW,radius)
+            self.straight(h+radius)
+            if h > radius:
+                self.straight(h-radius)
+            self.bend(180,CCW,radius)
+            if h > radius:
+                self.straight(h-radius)
+        if stop_bend:
+            self.bend(90,not CCW,radius)
+        else:
+            self.straight(radius)
+        return self
+    
+    def draw(self):
+        #add one polygon per gap: inner edge forward, outer edge back (filled as a strip of quads)
+        #long paths are split every _maxPathStations stations
+        n = _maxPathStations
+        for inner,outer in [self.edges[0:2],self.edges[2:4]]:
+            for i in range(0,len(inner)-1,n):
+                self.chip.add(SolidPline((0,0),points=inner[i:i+n+1]+outer[i:i+n+1][::-1],bgcolor=self.bgcolor,solidFillQuads=True,**self.kwargs))
+        self.edges = [[edge[-1]] for edge in self.edges]
+        self._straight = False
+        return self.chip
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,excType,excValue,traceback):
+        if excType is None:
+            self.draw()
+
 def Strip_wiggles(chip,structure,h=None,length=None,nTurns=None,maxWidth=None,CCW=True,start_bend = True,stop_bend=True,w=None,radius=None,bgcolor=None,**kwargs):
     def struct():
         if isinstance(structure,m.Structure):
@@ -1388,6 +1556,7 @@ def setupAirbridgeLayers(wafer:m.Wafer,BRLAYER='BRIDGE',RRLAYER='TETHER',brcolor
     wafer.addLayer(RRLAYER,rrcolor)
     wafer.RRLAYER=RRLAYER
 
+@m.instanced
 def Airbridge(
     chip, structure, cpw_w=None, cpw_s=None, xvr_width=None, xvr_length=None, rr_width=None, rr_length=None,
     rr_br_gap=None, rr_cpw_gap=None, shape_overlap=0, br_radius=0, clockwise=False, lincolnLabs=False, BRLAYER=None, RRLAYER=None, **kwargs):
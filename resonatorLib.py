@@ -19,10 +19,14 @@ from dxfwrite.vector2d import vadd, midpoint
 
 from maskLib.microwaveLib import Strip_bend,Strip_straight,Strip_stub_open,Strip_stub_short
 from maskLib.microwaveLib import CPW_bend,CPW_straight,CPW_stub_open,CPW_stub_round,CPW_stub_short
-from maskLib.microwaveLib import wiggle_calc,Inductor_wiggles
+from maskLib.microwaveLib import wiggle_calc,wiggle_calc_array,Inductor_wiggles
 
 from maskLib.Entities import SolidPline, SkewRect, CurveRect, RoundRect, InsideCurve
-from maskLib.utilities import kwargStrip
+from maskLib.utilities import kwargStrip, unitArc, getChordTolerance, chordSegments
+
+import math
+import numpy as np
+from functools import lru_cache
 
 
 # ===============================================================================
@@ -174,6 +178,49 @@ def JellyfishResonator(chip,structure,width,height,l_ind=None,tiny_cap=False,no_
     #update parent structure position, if callable
     structure.updatePos(s_0.start,newDir=s_0.direction)
     
+def JellyfishResonatorSweep(chip,structures,width,height,l_ind=None,nTurns=None,maxWidth=None,w_cap=None,s_cap=None,w_ind=3,r_ind=6,**kwargs):
+    '''
+    Draws a family of JellyfishResonators, one per structure (eg. a frequency sweep).
+    width, height, l_ind, nTurns and maxWidth are scalars or arrays with one entry per structure; other arguments
+    are passed to every JellyfishResonator. The inductor turns of the whole family are sized in one pass
+    (wiggle_calc_array), and resonators are drawn as component instances, so repeated parameter sets are drawn once.
+    returns {'nTurns','inductor_pad'} arrays (inductor_pad < 0 where the inductor is longer than the capacitor)
+    '''
+    def struct(s):
+        if isinstance(s,m.Structure):
+            return s
+        elif isinstance(s,tuple):
+            return m.Structure(chip,s)
+        else:
+            return chip.structure(s)
+    structs = [struct(s) for s in structures]
+    n = len(structs)
+    def perStruct(x,key=None,default=np.nan):
+        #one value per structure, taken from structure defaults if x is None
+        if x is None:
+            x = [s.defaults.get(key,default) for s in structs]
+        return np.broadcast_to(np.asarray(x,dtype=np.float64),(n,))
+    width,height,w_cap,s_cap = perStruct(width),perStruct(height),perStruct(w_cap,'w'),perStruct(s_cap,'s')
+    l_ind = np.broadcast_to(np.array(l_ind,dtype=object),(n,))
+    maxWidth = np.broadcast_to(np.array(maxWidth,dtype=object),(n,))
+    if nTurns is None:
+        #same as wiggle_calc in JellyfishResonator: the wiggles have to fit half the space inside the capacitor
+        Width = (width - 2*(w_cap+2*s_cap))/2
+        maxWidths = np.array([W if mw is None else min(mw,W) for mw,W in zip(maxWidth,Width)])
+        sized = np.array([l is not None for l in l_ind])
+        nTurns = np.ones(n,dtype=int)
+        nTurns[sized] = wiggle_calc_array(l_ind[sized].astype(np.float64),maxWidths[sized],r_ind,w_ind,perStruct(None,'s',0)[sized])['nTurns']
+    nTurns = np.broadcast_to(np.asarray(nTurns,dtype=int),(n,))
+    inductor_pad = np.maximum(height,2*s_cap+w_cap) - w_cap - 3*s_cap - (nTurns+0.5)*4*r_ind
+    
+    for i,s in enumerate(structs):
+        params = dict(l_ind=l_ind[i],nTurns=int(nTurns[i]),maxWidth=maxWidth[i],w_cap=float(w_cap[i]),s_cap=float(s_cap[i]),w_ind=w_ind,r_ind=r_ind)
+        if isinstance(chip,m.Chip) and getattr(chip.wafer,'instanceComponents',False):
+            chip.instance(JellyfishResonator,s,float(width[i]),float(height[i]),**params,**kwargs)
+        else:
+            JellyfishResonator(chip,s,float(width[i]),float(height[i]),**params,**kwargs)
+    return {'nTurns':nTurns,'inductor_pad':inductor_pad}
+    
 def DoubleJellyfishResonator(chip,structure,width,height,l_ind,w_cap=None,s_cap=None,r_cap=None,w_ind=3,r_ind=6,ialign=const.BOTTOM,nTurns=None,maxWidth=None,CCW=True,bgcolor=None,**kwargs):
     #WARNING- untested since 2020, may not work perfectly
     #inductor params: wire width = w_ind, radius (sets pitch) = r_ind, total inductor wire length = l_ind. ialign determines where the inductor should align to, (TOP = bunch at capacitor)
@@ -386,6 +433,48 @@ def CingularResonator(chip,structure,l_ind,w_ind=3,w_cap=None,s_cap=None,w_bridg
     Strip_straight(chip,s_r,(w_taper-w_ind)/2.,w=l_ind,**kwargs)
     Strip_straight(chip,s_l,(w_taper-w_ind)/2.,w=l_ind,**kwargs)
     
+@lru_cache(maxsize=None)
+def _sierpinskiTurns(CCW0,radius,dr,count,inside=False):
+    #90 degree turns (radius, CCW) of one vertex_out (or vertex_ins) of the sierpinski curve, in drawing order
+    if radius-dr<=0 or radius+dr<=0:    #abort if curve would be too tight
+        count=0
+    if count <= 0:  # The base case
+        return inside and ((radius-dr,not CCW0),) or ((radius+dr,CCW0),)
+    subcurves = inside and (True,False,True) or (True,False,False,False,True)
+    return sum((_sierpinskiTurns(CCW0,radius/2.0,dr,count-1,ins) for ins in subcurves),())
+
+_quarterTurns = ((1,0),(0,1),(-1,0),(0,-1)) #(cos,sin) of multiples of 90 degrees, exact
+
+_maxStripStations = 2000 #stations per polygon, keeps polygons within the GDSII vertex limit
+
+@lru_cache(maxsize=64)
+def _sierpinskiStrip(turns,w,ptDensity,tolerance):
+    #outline of a strip of width w following the turns, starting at the origin along +x
+    #returns read-only polygons (left edge forward, right edge back), split every _maxStripStations stations,
+    #and the end position and direction (degrees)
+    arcs = {}
+    pos, quarter = np.zeros(2), 0
+    left, right = [np.array([(0.,w/2)])], [np.array([(0.,-w/2)])]
+    for r,CCW in turns:
+        if (r,CCW) not in arcs:
+            t = CCW and -1 or 1 #side the bend turns to, as in Strip_bend
+            segments = tolerance is None and max(int(ptDensity/4),1) or chordSegments(r+w/2,math.pi/2,tolerance)
+            cos, sin = unitArc(math.pi/2,segments)[1:].T
+            arcs[r,CCW] = [np.column_stack(((r-t*d)*sin,t*r-t*(r-t*d)*cos)) for d in (w/2,-w/2)]+[np.array((r,t*r)),t]
+        l,rt,end,t = arcs[r,CCW]
+        c,s = _quarterTurns[quarter%4]
+        rot = np.array(((c,s),(-s,c)))
+        left.append(l @ rot + pos)
+        right.append(rt @ rot + pos)
+        pos = end @ rot + pos
+        quarter += t
+    left, right = np.concatenate(left), np.concatenate(right)
+    polygons = []
+    for i in range(0,len(left)-1,_maxStripStations):
+        polygons.append(np.concatenate((left[i:i+_maxStripStations+1],right[i:i+_maxStripStations+1][::-1])))
+        polygons[-1].flags.writeable = False
+    return tuple(polygons), tuple(pos), 90*quarter
+
 def SierpinskiResonator(chip,structure,l_ind,w_ind=3,recursions=2,w_cap=None,s_cap=None,w_bridge=None,r_bridge=None,w_taper=6,l_taper=None,r_taper=None,ralign=const.BOTTOM,bgcolor=None,debug=False,**kwargs):
     '''
     Draws a resonator following a modified sierpinski curve. 
@@ -464,39 +553,21 @@ def SierpinskiResonator(chip,structure,l_ind,w_ind=3,recursions=2,w_cap=None,s_c
     #draw center, left right arms
     chip.add(dxf.rectangle(struct().start, s_cap, w_bridge,valign=const.MIDDLE,halign=const.CENTER,rotation=struct().direction,bgcolor=bgcolor,**kwargStrip(kwargs)))
     
-    #subfunctions, defined by right hand side (CCW0=True)
-    def vertex_out(structure,CCW0,radius,count=0):
-        if radius-dr<=0 or radius+dr<=0:    #abort if curve would be too tight
-            count=0
-        if count <= 0:  # The base case
-            #draw curve
-            Strip_bend(chip, structure,CCW=CCW0,radius=radius+dr,bgcolor=bgcolor,**kwargs)
-        else:
-            count -=1
-            vertex_ins(structure,CCW0,radius/2.0,count)
-            vertex_out(structure,CCW0,radius/2.0,count)
-            vertex_out(structure,CCW0,radius/2.0,count)
-            vertex_out(structure,CCW0,radius/2.0,count)
-            vertex_ins(structure,CCW0,radius/2.0,count)
-            
-    def vertex_ins(structure,CCW0,radius,count=0):
-        if radius-dr<=0 or radius+dr<=0:    #abort if curve would be too tight
-            count=0
-        if count <=0:   #The base case
-            #draw curve
-            Strip_bend(chip, structure,CCW=not CCW0,radius=radius-dr,bgcolor=bgcolor,**kwargs)
-        else:
-            count -=1
-            vertex_ins(structure,CCW0,radius/2.0,count)
-            vertex_out(structure,CCW0,radius/2.0,count)
-            vertex_ins(structure,CCW0,radius/2.0,count)
-    
-    #0th order is square
-    vertex_out(s_r,CCW0=True,radius=r_eff,count=recursions)
-    vertex_out(s_r,CCW0=True,radius=r_eff,count=recursions)
-    
-    vertex_out(s_l,CCW0=False,radius=r_eff,count=recursions)
-    vertex_out(s_l,CCW0=False,radius=r_eff,count=recursions)
+    #each arm is two vertex_out curves, defined by right hand side (CCW0=True). The turns and the strip outline
+    #are generated once per curve, and drawn as one polygon (split up for very long curves)
+    ptDensity = kwargs.get('ptDensity',120)
+    tolerance = getChordTolerance(kwargs.get('tolerance'))
+    for s_arm,CCW0 in ((s_r,True),(s_l,False)):
+        turns = _sierpinskiTurns(CCW0,r_eff,dr,int(recursions))*2
+        if min(r for r,CCW in turns) <= s_cap/2.:
+            #inner edge would collapse, let CurveRect round these corners
+            for r,CCW in turns:
+                Strip_bend(chip,s_arm,CCW=CCW,radius=r,bgcolor=bgcolor,**kwargs)
+            continue
+        polygons,end,angle = _sierpinskiStrip(turns,s_cap,ptDensity,tolerance)
+        for pts in polygons:
+            chip.add(SolidPline(s_arm.start,rotation=s_arm.direction,points=pts,bgcolor=bgcolor,solidFillQuads=True,**kwargStrip(kwargs)))
+        s_arm.updatePos(newStart=s_arm.getPos(end),angle=angle)
     
     
     #draw inductor bridge
@@ -8,14 +8,419 @@ from dxfwrite import DXFEngine as dxf
 from dxfwrite.algebra import rotate_2d
 from dxfwrite.vector2d import vadd,midpoint,vmul_scalar,vsub
 import math
+from contextlib import contextmanager
+from functools import lru_cache
+
+import numpy as np
+
+# ===============================================================================
+#  ARRAY GEOMETRY FUNCTIONS
+#       points are handled as (N,2) float64 arrays so whole shapes are transformed at once
+# ===============================================================================
+
+def pointArray(points):
+    # return points as an (N,2) float64 array. (x,y,z) points lose their z
+    pts = np.asarray(points,dtype=np.float64)
+    if pts.size == 0:
+        return pts.reshape(0,2)
+    if pts.ndim == 1:
+        pts = pts[None] #a single point
+    if pts.shape[-1] not in (2,3):
+        raise ValueError('points need 2 or 3 coordinates, got shape '+str(pts.shape))
+    return pts[...,:2].reshape(-1,2)
+
+def toPoints(points):
+    # convert a point array back to a list of tuples (what dxfwrite entities expect)
+    return list(zip(*pointArray(points).T.tolist()))
+
+def rotationMatrix(angle):
+    # matrix rotating row vectors CCW by angle (radians): pts @ rotationMatrix(angle). Same convention as rotate_2d
+    c = math.cos(angle)
+    s = math.sin(angle)
+    return np.array([[c,s],[-s,c]])
+
+def transformPoints(points,insert=(0,0),rotation=0.,scale=(1,1),offset=(0,0)):
+    # batched affine transform, applied in the order: shift by offset, scale (use -1 to flip), rotate about origin (radians), move to insert
+    # returns (N,2) float64 array
+    pts = (pointArray(points) + offset) * scale
+    if rotation:
+        pts = pts @ rotationMatrix(rotation)
+    return pts + insert
+
+def _gridCrossings(a0,b0,a1,b1,kmin,kmax,strict=False):
+    # find every integer grid line k (kmin <= k <= kmax) crossed by the edges (a0,b0)->(a1,b1) along axis a
+    # returns k and the b coordinate of each crossing. edges running along a grid line are skipped
+    if strict:
+        lo = np.floor(np.minimum(a0,a1)) + 1
+        hi = np.ceil(np.maximum(a0,a1)) - 1
+    else:
+        lo = np.ceil(np.minimum(a0,a1))
+        hi = np.floor(np.maximum(a0,a1))
+    n = np.maximum(np.minimum(hi,kmax) - np.maximum(lo,kmin) + 1,0).astype(int)
+    n[a0 == a1] = 0
+    total = n.sum()
+    if total == 0:
+        return np.empty(0),np.empty(0)
+    e = np.repeat(np.arange(len(a0)),n)
+    k = np.maximum(lo,kmin)[e] + np.arange(total) - np.repeat(np.cumsum(n)-n,n)
+    b = b0[e] + (k - a0[e])*(b1[e]-b0[e])/(a1[e]-a0[e])
+    return k,b
+
+def rasterizePolygon(mask,points):
+    # mark every cell of the boolean grid mask (indexed [x][y], cell i spans [i,i+1] in grid units) which a closed polygon touches
+    # a cell is marked if a polygon edge touches it, or if its center is inside the polygon (even-odd rule)
+    nx, ny = mask.shape
+    pts = pointArray(points)
+    if len(pts) == 0:
+        return mask
+    x0, y0 = pts.T
+    x1, y1 = np.roll(pts,-1,axis=0).T
+    
+    #--- edges: every point where the outline meets a grid line (or a vertex) touches the cells on all sides of it
+    kx, yk = _gridCrossings(x0,y0,x1,y1,0,nx)
+    ky, xk = _gridCrossings(y0,x0,y1,x1,0,ny)
+    px = np.concatenate((x0,kx,xk))
+    py = np.concatenate((y0,yk,ky))
+    for cx in (np.floor(px),np.ceil(px)-1):
+        for cy in (np.floor(py),np.ceil(py)-1):
+            inGrid = (cx >= 0) & (cx < nx) & (cy >= 0) & (cy < ny)
+            mask[cx[inGrid].astype(int),cy[inGrid].astype(int)] = True
+    
+    #--- interior: scanline through each row of cell centers, toggling parity at every edge crossing
+    i0 = int(max(np.floor(pts[:,0].min()),0))
+    i1 = int(min(np.floor(pts[:,0].max()),nx-1))
+    j0 = int(max(np.floor(pts[:,1].min()),0))
+    j1 = int(min(np.floor(pts[:,1].max()),ny-1))
+    if i1 < i0 or j1 < j0:
+        return mask
+    #rows j cross an edge if min(y) <= j + 0.5 < max(y) (half open so shared vertices count once)
+    jy, xj = _gridCrossings(y0-0.5,x0,y1-0.5,x1,j0,j1,strict=True)
+    #the shifted-by-half test above is strict, add the edges whose lower end sits exactly on a center line
+    lower = np.where(y0 < y1,y0,y1) - 0.5
+    exact = (y0 != y1) & (lower == np.floor(lower)) & (lower >= j0) & (lower <= j1)
+    jy = np.concatenate((jy,lower[exact]))
+    xj = np.concatenate((xj,np.where(y0 < y1,x0,x1)[exact]))
+    if len(jy):
+        #crossing at x toggles every cell in the row whose center lies right of x
+        k = np.clip(np.floor(xj - 0.5) + 1 - i0,0,i1-i0+1).astype(int)
+        w = i1 - i0 + 2
+        toggles = np.bincount((jy.astype(int)-j0)*w + k,minlength=(j1-j0+1)*w).reshape(j1-j0+1,w)
+        inside = (np.cumsum(toggles,axis=1)[:,:-1] & 1).astype(bool)
+        mask[i0:i1+1,j0:j1+1] |= inside.T
+    return mask
+
+def dilateMask(mask,radius=1):
+    # grow the True region of a boolean grid by radius cells, one 4-neighbour step per pass
+    for r in range(radius):
+        grown = mask.copy()
+        grown[1:,:] |= mask[:-1,:]
+        grown[:-1,:] |= mask[1:,:]
+        grown[:,1:] |= mask[:,:-1]
+        grown[:,:-1] |= mask[:,1:]
+        mask = grown
+    return mask
+
+def cellRuns(mask):
+    # cover the True cells of a boolean grid (indexed [x][y]) with rectangles of cells
+    # runs along y in each column are found first, then identical runs in neighbouring columns are merged
+    # returns a list of ((i,j),(columns,rows)) in column order
+    nx, ny = mask.shape
+    padded = np.zeros((nx,ny+2),dtype=np.int8)
+    padded[:,1:-1] = mask
+    edges = np.diff(padded,axis=1)
+    runs = []
+    open_runs = {}
+    for i in range(nx):
+        starts = np.nonzero(edges[i] == 1)[0]
+        stops = np.nonzero(edges[i] == -1)[0]
+        current = {}
+        for j,stop in zip(starts.tolist(),stops.tolist()):
+            key = (j,stop-j)
+            if key in open_runs:
+                current[key] = open_runs.pop(key)
+                current[key][1] += 1
+            else:
+                current[key] = [i,1]
+        for (j,rows),(start,cols) in open_runs.items():
+            runs.append(((start,j),(cols,rows)))
+        open_runs = current
+    for (j,rows),(start,cols) in open_runs.items():
+        runs.append(((start,j),(cols,rows)))
+    runs.sort()
+    return runs
+
+# ===============================================================================
+#  POLYGON BOOLEANS
+#       union (or), intersection (and), difference (not) and xor of two sets of polygons with a scanline: the plane
+#       is cut into horizontal slabs at every vertex and edge crossing, and the edges in each slab are walked left to
+#       right counting windings. Polygons are made counterclockwise first, so overlapping polygons of a set merge
+#       the result is a list of y-monotone pieces (stacks of trapezoids), which have no holes and can be written
+#       to DXF or GDSII as they are
+# ===============================================================================
+
+_booleanOps = {
+    'or':  lambda a,b: a | b,
+    'and': lambda a,b: a & b,
+    'not': lambda a,b: a & ~b,
+    'xor': lambda a,b: a ^ b,
+    }
+_booleanEps = 1e-6 #um, coordinates closer than this are the same (input is rounded to this grid)
+_booleanBand = 1<<21 #edge / slab pairs swept at once
+
+def _booleanEdges(polygons,operand):
+    # non horizontal edges of counterclockwise polygons as rows (x0,y0,x1,y1,winding,operand), with y0 < y1
+    # winding is the change of winding number when crossing the edge left to right
+    rows = []
+    for poly in polygons:
+        p = np.round(pointArray(poly),6)
+        q = np.roll(p,-1,axis=0)
+        if np.sum(p[:,0]*q[:,1] - q[:,0]*p[:,1]) < 0:
+            p,q = q,p
+        keep = p[:,1] != q[:,1]
+        p,q = p[keep],q[keep]
+        up = q[:,1] > p[:,1]
+        rows.append(np.column_stack([np.where(up[:,None],p,q),np.where(up[:,None],q,p),
+                                     np.where(up,-1.,1.),np.full(len(p),float(operand))]))
+    return rows
+
+def _slabTrapezoids(x0,y0,x1,y1,windA,windB,ys,op):
+    # trapezoids of the result in the slabs between ys (sorted). Slabs are split at edge crossings first, so the
+    # edges keep their order inside each slab. returns rows (left edge,right edge,y0,xl0,xr0,y1,xl1,xr1), with
+    # trapezoids between the same two edges in consecutive slabs joined
+    eps = _booleanEps
+    while True:
+        first = np.maximum(np.searchsorted(ys,y0,'right')-1,0)
+        count = np.maximum(np.minimum(np.searchsorted(ys,y1,'left'),len(ys)-1) - first,0)
+        edge = np.repeat(np.arange(len(x0)),count)
+        slab = np.arange(len(edge)) - np.repeat(np.cumsum(count)-count-first,count)
+        t0,t1 = (ys[slab]-y0[edge])/(y1[edge]-y0[edge]),(ys[slab+1]-y0[edge])/(y1[edge]-y0[edge])
+        xb,xt = x0[edge]*(1-t0) + x1[edge]*t0,x0[edge]*(1-t1) + x1[edge]*t1
+        #edges in order at mid height. Neighbours out of order at the bottom or top of the slab cross inside it,
+        #split there until no slab has crossings
+        s = np.argsort(xb+xt)
+        s = s[np.argsort(slab[s],kind='stable')]
+        edge,slab,xb,xt = edge[s],slab[s],xb[s],xt[s]
+        cross = np.nonzero((slab[1:] == slab[:-1]) & ((xb[1:] < xb[:-1] - eps) | (xt[1:] < xt[:-1] - eps)))[0]
+        if len(cross):
+            db,dt = xb[cross+1] - xb[cross],xt[cross+1] - xt[cross]
+            lo,hi = ys[slab[cross]],ys[slab[cross]+1]
+            yc = lo + db/(db-dt)*(hi-lo)
+            yc = yc[(yc > lo + eps) & (yc < hi - eps)]
+            if len(yc):
+                ys = np.union1d(ys,yc)
+                continue
+        break
+    #walk the edges of each slab left to right (windings of each set add up to zero over a slab)
+    inside = op(np.cumsum(windA[edge]) > 0,np.cumsum(windB[edge]) > 0)
+    change = np.diff(np.concatenate([[False],inside]).astype(np.int8))
+    l,r = np.nonzero(change == 1)[0],np.nonzero(change == -1)[0]
+    if not len(l):
+        return np.zeros((0,8))
+    #join trapezoids which touch along a shared edge, drop empty ones
+    join = (slab[l][1:] == slab[l][:-1]) & (xb[l][1:] - xb[r][:-1] < eps) & (xt[l][1:] - xt[r][:-1] < eps)
+    l,r = l[np.append(True,~join)],r[np.append(~join,True)]
+    keep = (xb[r] - xb[l] > eps) | (xt[r] - xt[l] > eps)
+    l,r = l[keep],r[keep]
+    if not len(l):
+        return np.zeros((0,8))
+    left,right,slab = edge[l],edge[r],slab[l]
+    s = np.lexsort((slab,right,left))
+    new = np.append(True,(np.diff(left[s]) != 0) | (np.diff(right[s]) != 0) | (np.diff(slab[s]) != 1))
+    first,last = s[new],s[np.append(np.nonzero(new)[0][1:]-1,len(s)-1)]
+    return np.column_stack([left[first],right[first],ys[slab[first]],xb[l[first]],xb[r[first]],
+                            ys[slab[last]+1],xt[l[last]],xt[r[last]]])
+
+def _countBefore(line,x,qline,qx,inclusive=False):
+    # for each query, the number of (line,x) on the same line with x < qx (x <= qx if inclusive)
+    isq = np.append(np.zeros(len(line),dtype=bool),np.ones(len(qline),dtype=bool))
+    s = np.lexsort((isq if inclusive else ~isq,np.append(x,qx),np.append(line,qline)))
+    before = np.cumsum(~isq[s])
+    count = np.empty(len(qline),dtype=np.intp)
+    count[s[isq[s]]-len(line)] = before[isq[s]]
+    return count - np.searchsorted(np.sort(line),qline,'left')
+
+def _boxGroups(boxes):
+    # group number of each box (rows xmin,ymin,xmax,ymax): connected groups of overlapping or touching boxes
+    s = np.argsort(boxes[:,0],kind='stable')
+    xmin = boxes[s,0]
+    #candidate pairs start inside each other along x, keep those which overlap along y
+    count = np.searchsorted(xmin,boxes[s,2],'right') - np.arange(len(s)) - 1
+    i = np.repeat(np.arange(len(s)),count)
+    j = np.arange(len(i)) - np.repeat(np.cumsum(count)-count,count) + i + 1
+    i,j = s[i],s[j]
+    touch = (boxes[i,1] <= boxes[j,3]) & (boxes[j,1] <= boxes[i,3])
+    i,j = i[touch],j[touch]
+    #spread the smallest box number over each group
+    group = np.arange(len(boxes))
+    while True:
+        low = group.copy()
+        np.minimum.at(low,i,group[j])
+        np.minimum.at(low,j,group[i])
+        low = low[low]
+        if np.array_equal(low,group):
+            break
+        group = low
+    return np.unique(group,return_inverse=True)[1]
+
+def _booleanTrapezoids(a,b,operation):
+    # sweep the slabs bottom to top. returns trapezoids as rows (piece,left edge,right edge,y0,xl0,xr0,y1,xl1,xr1),
+    # by piece and from the bottom. A trapezoid continues the piece below it if each overlaps no other trapezoid
+    # across the slab line
+    op = _booleanOps[operation]
+    edges = [e for e in _booleanEdges(a,0) + _booleanEdges(b,1) if len(e)]
+    if not edges:
+        return np.zeros((0,9))
+    x0,y0,x1,y1,wind,operand = np.concatenate(edges).T
+    windA = np.where(operand == 0,wind,0.)
+    windB = wind - windA
+    eps = _booleanEps
+    #polygons which can't touch are stacked above each other for the sweep, so they don't cut each others slabs
+    starts = np.cumsum([0]+[len(e) for e in edges[:-1]])
+    boxes = np.column_stack([np.minimum.reduceat(np.minimum(x0,x1),starts),np.minimum.reduceat(y0,starts),
+                             np.maximum.reduceat(np.maximum(x0,x1),starts),np.maximum.reduceat(y1,starts)])
+    group = _boxGroups(boxes)
+    bottom = np.full(group.max()+1,np.inf)
+    top = np.full(group.max()+1,-np.inf)
+    np.minimum.at(bottom,group,boxes[:,1])
+    np.maximum.at(top,group,boxes[:,3])
+    shift = np.cumsum(top-bottom+1) - (top-bottom+1) - bottom
+    shift = np.repeat(shift[group],[len(e) for e in edges])
+    y0,y1 = y0+shift,y1+shift
+    #bands of slabs with about _booleanBand edge / slab pairs each
+    ys = np.unique(np.concatenate([y0,y1]))
+    pairs = np.cumsum(np.searchsorted(np.sort(y0),ys[:-1],'right') - np.searchsorted(np.sort(y1),ys[:-1],'right'))
+    bounds = np.unique(np.concatenate([[0],np.searchsorted(pairs,np.arange(_booleanBand,pairs[-1],_booleanBand)),[len(ys)-1]]))
+    rows = []
+    for ka,kb in zip(bounds[:-1],bounds[1:]):
+        band = np.nonzero((y0 < ys[kb]) & (y1 > ys[ka]))[0]
+        traps = _slabTrapezoids(x0[band],y0[band],x1[band],y1[band],windA[band],windB[band],ys[ka:kb+1],op)
+        traps[:,:2] = band[traps[:,:2].astype(np.intp)]
+        rows.append(traps)
+    rows = np.concatenate(rows)
+    if not len(rows):
+        return np.zeros((0,9))
+    left,right,ylo,xl0,xr0,yhi,xl1,xr1 = rows.T
+    #link trapezoids starting on a slab line to the one ending there they overlap, if neither overlaps another
+    lines = np.unique(np.append(ylo,yhi))
+    start,end = np.searchsorted(lines,ylo),np.searchsorted(lines,yhi)
+    lo = _countBefore(end,xr1,start,xl0 + eps,inclusive=True)
+    single = _countBefore(end,xl1,start,xr0 - eps) - lo == 1
+    ends = np.lexsort((xl1,end))
+    below = ends[np.minimum(np.searchsorted(end[ends],start,'left') + lo,len(ends)-1)]
+    above = _countBefore(start,xl0,end,xr1 - eps) - _countBefore(start,xr0,end,xl1 + eps,inclusive=True)
+    single &= above[below] == 1
+    piece = np.arange(len(rows))
+    piece[single] = below[single]
+    while True:
+        root = piece[piece]
+        if np.array_equal(root,piece):
+            break
+        piece = root
+    s = np.lexsort((ylo,piece))
+    rows[:,[2,5]] -= shift[left.astype(np.intp)][:,None]
+    return np.column_stack([piece[s],rows[s]])
+
+def _simplifyOutline(pts):
+    # drop repeated and collinear points (including spikes) of a closed outline
+    pts = pts[np.any(np.abs(pts - np.roll(pts,1,axis=0)) > _booleanEps,axis=1)]
+    if len(pts) < 3:
+        return pts
+    prv,nxt = np.roll(pts,1,axis=0),np.roll(pts,-1,axis=0)
+    cross = (pts[:,0]-prv[:,0])*(nxt[:,1]-pts[:,1]) - (pts[:,1]-prv[:,1])*(nxt[:,0]-pts[:,0])
+    return pts[np.abs(cross) > _booleanEps*np.hypot(*(nxt-prv).T)]
+
+def polygonBoolean(a,b=(),operation='or',maxPoints=None,fill=False):
+    '''
+    Boolean operation on two sets of polygons (lists of (N,2) arrays or lists of points): 'or' (union), 'and'
+    (intersection), 'not' (a minus b) or 'xor'. Overlapping polygons within a set are merged first
+    returns a list of (N,2) arrays: simple counterclockwise polygons without holes (a region with holes comes back
+    as several pieces), each with at most maxPoints points
+    fill: return (outline, trapezoids) pairs instead, with the trapezoids making up the piece as an (M,4,2) array
+          of corners in polygon order (counterclockwise, as dxf.solid takes them)
+    '''
+    if operation not in _booleanOps:
+        raise ValueError('Unknown boolean operation '+str(operation)+', use one of '+str(tuple(_booleanOps)))
+    rows = _booleanTrapezoids(a,b,operation)
+    if not len(rows):
+        return []
+    #consecutive trapezoids of a piece between the same two edges are parts of one trapezoid
+    first = np.nonzero(np.append(True,np.any(rows[1:,:3] != rows[:-1,:3],axis=1)))[0]
+    last = np.append(first[1:]-1,len(rows)-1)
+    traps = np.column_stack([rows[first,:1],rows[first,3:6],rows[last,6:9]])
+    pieces = np.split(traps,np.nonzero(np.diff(traps[:,0]))[0]+1)
+    if maxPoints is not None:
+        #each trapezoid adds at most four points to the outline
+        size = max(maxPoints//4,1)
+        pieces = [piece[i:i+size] for piece in pieces for i in range(0,len(piece),size)]
+    result = []
+    for piece in pieces:
+        y0,xl0,xr0,y1,xl1,xr1 = piece[:,1:].T
+        left = np.column_stack([np.column_stack([xl0,xl1]).ravel(),np.column_stack([y0,y1]).ravel()])
+        right = np.column_stack([np.column_stack([xr0,xr1]).ravel(),np.column_stack([y0,y1]).ravel()])
+        outline = _simplifyOutline(np.concatenate([right,left[::-1]]))
+        if len(outline) < 3:
+            continue
+        if fill:
+            result.append((outline,np.stack([np.column_stack(c) for c in [(xl0,y0),(xr0,y0),(xr1,y1),(xl1,y1)]],axis=1)))
+        else:
+            result.append(outline)
+    return result
+
+# ===============================================================================
+#  CURVE DISCRETIZATION
+#       by default curves get a fixed number of points per revolution (ptDensity). With a chord tolerance (um), the
+#       number of segments follows from the radius instead, so no chord is further than the tolerance from the arc
+#       the tolerance is passed per shape (tolerance=...), or set for everything drawn afterwards
+#       the unit circle points of an arc are tabulated once per (angle, segments) and shared by all curves
+# ===============================================================================
+_chordTolerance = [None]
+
+def getChordTolerance(tolerance=None):
+    # tolerance in effect: the argument if given, otherwise the current default (None: use ptDensity)
+    return tolerance if tolerance is not None else _chordTolerance[-1]
+
+def setChordTolerance(tolerance):
+    # chord tolerance for all curves created from now on (None: back to ptDensity). Inside a chordTolerance block
+    # this replaces the block's tolerance, until the block exits
+    _chordTolerance[-1] = tolerance
+
+@contextmanager
+def chordTolerance(tolerance):
+    # chord tolerance for curves created inside the with block
+    _chordTolerance.append(tolerance)
+    try:
+        yield
+    finally:
+        _chordTolerance.pop()
+
+def chordSegments(radius,angle,tolerance):
+    # fewest segments for an arc of radius and angle (radians) whose chords stay within tolerance of the arc
+    # (each segment spans at most 2*acos(1-tolerance/radius))
+    radius = abs(radius)
+    if radius <= tolerance:
+        return max(int(math.ceil(abs(angle)/math.pi)),1)
+    return max(int(math.ceil(abs(angle)/(2*math.acos(1-tolerance/radius)) - 1e-9)),1)
+
+@lru_cache(maxsize=4096)
+def _unitArc(angle,segments):
+    arc = np.linspace(0,angle,segments+1)
+    arc = np.column_stack((np.cos(arc),np.sin(arc)))
+    arc.flags.writeable = False
+    return arc
+
+def unitArc(angle,segments):
+    # (segments+1,2) array of unit circle points (cos,sin) from 0 to angle (radians) in equal steps
+    # memoized: curves sharing angle and segment count reuse one table, which is scaled and offset (don't modify it)
+    return _unitArc(float(angle),int(segments))
 
 # ===============================================================================
 #  UTILITY FUNCTIONS  
 # ===============================================================================
      
 
-def curveAB(a,b,clockwise=True,angleDeg=90,ptDensity=120):
+def curveAB(a,b,clockwise=True,angleDeg=90,ptDensity=120,tolerance=None):
     # generate a segmented curve from A to B specified by angle. Point density = #pts / revolution
+    # or max chord deviation = tolerance (see chordTolerance)
     # return list of points
     # clockwise can be boolean {1,0} or sign type {1,-1}
     
@@ -23,20 +428,25 @@ def curveAB(a,b,clockwise=True,angleDeg=90,ptDensity=120):
         clockwise = -1
         
     angle = math.radians(angleDeg)
-    segments = int(angle/(2*math.pi) *ptDensity)
+    tolerance = getChordTolerance(tolerance)
+    if tolerance is None:
+        segments = int(angle/(2*math.pi) *ptDensity)
+    else:
+        segments = chordSegments(0.5*math.hypot(b[0]-a[0],b[1]-a[1])/math.sin(angle/2),angle,tolerance)
     center = vadd(midpoint(a,b),vmul_scalar(rotate_2d(vsub(b,a),-clockwise*math.pi/2),0.5/math.tan(angle/2)))
-    points = []
-    for i in range(segments+1):
-        points.append(vadd(center,rotate_2d(vsub(a,center),-clockwise*i*angle/segments)))
-    return points
+    #rotate the radius vector (a - center) to every segment angle at once
+    cos, sin = unitArc(-clockwise*angle,segments).T
+    r = vsub(a,center)
+    points = np.column_stack((r[0]*cos - r[1]*sin,r[1]*cos + r[0]*sin)) + center
+    return toPoints(points)
 
-def cornerRound(vertex,quadrant,radius,clockwise=True,ptDensity=120):
+def cornerRound(vertex,quadrant,radius,clockwise=True,ptDensity=120,tolerance=None):
     #quadrant corresponds to quadrants 1-4
     #generate a curve to replace the vertex
     ptA = vadd(vertex,rotate_2d((0,radius),quadrant * math.pi/2))
     ptB = vadd(vertex,rotate_2d((0,radius),(quadrant+1) * math.pi/2))
 
-    return clockwise>0 and curveAB(ptA,ptB,1,ptDensity=ptDensity) or curveAB(ptB,ptA,-1,ptDensity=ptDensity)
+    return clockwise>0 and curveAB(ptA,ptB,1,ptDensity=ptDensity,tolerance=tolerance) or curveAB(ptB,ptA,-1,ptDensity=ptDensity,tolerance=tolerance)
 
 def transformedQuadrants(vflip=False,hflip=False):
     #return quadrant list with vertical and horizontal flips applied. Updated to match dxfwrite style